@@ -0,0 +1,113 @@
+"""
+Callback dispatch micro-benchmark: aiogram filter chain vs prefix router.
+
+    python bench/bench_callbacks.py [iterations]
+
+"legacy" registers one F.data.startswith(...) handler per prefix (the old
+layout: every filter is evaluated in turn, then the handler splits and checks
+arity). "router" registers a single handler that calls main.parse_callback and
+dispatches through a dict. Handlers are no-ops, so the numbers are the cost of
+routing alone. No network and no database are touched.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Update
+
+import main
+
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)  # per-update INFO lines skew timings
+
+CALLBACKS = [
+    "lang:ru", "menu:prices", "plat:tiktok", "srv:tiktok_likes",
+    "pack:tiktok_likes:100", "admin:pending", "menu:home", "bogus:1",
+]
+LEGACY_ORDER = [("lang:", 2), ("menu:", 2), ("plat:", 2), ("srv:", 2), ("pack:", 3), ("admin:", 2)]
+
+def make_update(i: int, data: str) -> Update:
+    user = {"id": 1000 + i % 50, "is_bot": False, "first_name": "bench"}
+    return Update.model_validate({
+        "update_id": i,
+        "callback_query": {
+            "id": str(i), "from": user, "chat_instance": "bench", "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user["id"], "type": "private"}, "text": "x"},
+        },
+    })
+
+def legacy_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    for prefix, arity in LEGACY_ORDER:
+        async def handler(cb, arity=arity):
+            parts = cb.data.split(":")
+            if len(parts) != arity:
+                return
+        dp.callback_query.register(handler, F.data.startswith(prefix))
+
+    async def fallback(cb):
+        return
+    dp.callback_query.register(fallback)
+    return dp
+
+def router_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    async def noop(cb, data):
+        return
+    routes = {prefix: noop for prefix in main.CALLBACK_ROUTES}
+
+    async def on_callback(cb):
+        data = main.parse_callback(cb.data)
+        if data is None:
+            return
+        await routes[data.prefix](cb, data)
+    dp.callback_query.register(on_callback)
+    return dp
+
+async def run(dp: Dispatcher, bot: Bot, updates) -> float:
+    start = time.perf_counter()
+    for u in updates:
+        await dp.feed_update(bot, u)
+    return time.perf_counter() - start
+
+def bench_parse(n: int):
+    data = CALLBACKS * (n // len(CALLBACKS))
+    start = time.perf_counter()
+    for d in data:
+        parts = d.split(":")
+        if d.startswith("pack:") and (len(parts) != 3 or not parts[2].isdigit()):
+            pass
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for d in data:
+        main.parse_callback(d)
+    router = time.perf_counter() - start
+    return len(data), legacy, router
+
+async def amain(n: int):
+    bot = Bot(token=os.environ["BOT_TOKEN"])
+    updates = [make_update(i, CALLBACKS[i % len(CALLBACKS)]) for i in range(n)]
+    legacy, router = legacy_dispatcher(), router_dispatcher()
+    await run(legacy, bot, updates[:500])  # warm-up
+    await run(router, bot, updates[:500])
+    t_legacy = await run(legacy, bot, updates)
+    t_router = await run(router, bot, updates)
+    await bot.session.close()
+
+    print(f"feed_update x{n}")
+    print(f"  legacy filter chain : {n / t_legacy:10.0f} upd/s  {t_legacy / n * 1e6:7.1f} us/upd")
+    print(f"  prefix router       : {n / t_router:10.0f} upd/s  {t_router / n * 1e6:7.1f} us/upd")
+    print(f"  speedup             : {t_legacy / t_router:10.2f}x")
+
+    count, p_legacy, p_router = bench_parse(n * 10)
+    print(f"parse only x{count}")
+    print(f"  split + manual check: {p_legacy / count * 1e9:7.0f} ns/op")
+    print(f"  parse_callback      : {p_router / count * 1e9:7.0f} ns/op (typed, validated)")
+
+if __name__ == "__main__":
+    asyncio.run(amain(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
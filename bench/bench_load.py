@@ -0,0 +1,200 @@
+"""
+Offline load test: the real Dispatcher and handlers fed with synthetic updates.
+
+    python bench/bench_load.py [--users 500] [--concurrency 50] [--admin-rounds 20]
+                               [--latency-ms 0] [--limiter]
+
+Every synthetic user walks the purchase funnel
+/start -> lang: -> menu:prices -> plat: -> srv: -> pack: -> menu:sendcheck ->
+photo proof,
+then opens "My orders". Its steps run in order, and up to --concurrency users
+run at the same time. An admin runs the admin flows (/admin, pending list,
+stats, bulk done) alongside them. Updates go through main.dp.feed_update with a
+mocked Bot session: no network calls, each API call just sleeps --latency-ms.
+The database is a fresh file in a temp dir; the repo's bot.db is never touched.
+The outbound rate limiter is off by default (it would measure SEND_GLOBAL_RATE,
+not the handlers); --limiter turns it on.
+
+Output: overall updates/sec and p50/p95/p99 latency of feed_update per handler.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+import main
+
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)  # per-update INFO lines skew timings
+logging.getLogger("smm_bot").setLevel(logging.WARNING)
+
+ADMIN_ID = min(main.ADMIN_IDS)
+
+class MockSession(BaseSession):
+    """Answers every Bot API call with True after `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = defaultdict(int)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+_ids = iter(range(1, 10 ** 9))
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": "bench"}
+
+def _message(uid: int, **fields) -> dict:
+    return {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+            "from": _user(uid), **fields}
+
+def text_update(uid: int, text: str) -> Update:
+    fields = {"text": text}
+    if text.startswith("/"):
+        fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.model_validate({"update_id": next(_ids), "message": _message(uid, **fields)})
+
+def photo_update(uid: int) -> Update:
+    n = next(_ids)
+    photo = [{"file_id": f"bench{n}", "file_unique_id": f"u{n}", "width": 1, "height": 1}]
+    return Update.model_validate({"update_id": n, "message": _message(uid, photo=photo)})
+
+def callback_update(uid: int, data: str) -> Update:
+    n = next(_ids)
+    return Update.model_validate({"update_id": n, "callback_query": {
+        "id": str(n), "from": _user(uid), "chat_instance": "bench", "data": data,
+        "message": _message(uid, text="x"),
+    }})
+
+def callback_label(data: str) -> str:
+    # name of the routed handler, e.g. "pack:..." -> "on_pack"
+    parsed = main.parse_callback(data)
+    return main.CALLBACK_ROUTES[parsed.prefix][0].__name__ if parsed else "on_unknown_callback"
+
+PLATFORM = "tiktok"
+
+def funnel(uid: int, i: int):
+    service = next(iter(main.SERVICES[PLATFORM]))
+    packs = main.catalog_packs(PLATFORM, service)
+    qty = packs[i % len(packs)][0]
+    steps = [
+        ("cmd_start", text_update(uid, "/start")),
+        *[(callback_label(d), callback_update(uid, d)) for d in (
+            "lang:ru", "menu:prices", f"plat:{PLATFORM}", f"srv:{service}", f"pack:{service}:{qty}",
+            "menu:sendcheck")],
+        ("on_proof", photo_update(uid)),
+        (callback_label("menu:orders"), callback_update(uid, "menu:orders")),
+    ]
+    return steps
+
+def admin_round():
+    return [
+        ("cmd_admin", text_update(ADMIN_ID, "/admin")),
+        ("on_admin", callback_update(ADMIN_ID, "admin:pending")),
+        ("on_admin", callback_update(ADMIN_ID, "admin:stats")),
+        ("on_admin", callback_update(ADMIN_ID, "admin:done")),
+        ("on_text", None),  # built at run time: needs real pending ids
+    ]
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+async def amain(args):
+    main.STORAGE.path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    await main.startup()
+    session = MockSession(args.latency_ms / 1000)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    if args.limiter:
+        bot.session.middleware(main.OUTBOUND)
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def feed(label: str, update: Update):
+        start = time.perf_counter()
+        try:
+            await main.dp.feed_update(bot, update)
+        except Exception as e:
+            errors[f"{label}: {type(e).__name__}"] += 1
+        timings[label].append(time.perf_counter() - start)
+
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def user_flow(i: int):
+        async with sem:
+            for label, upd in funnel(100000 + i, i):
+                await feed(label, upd)
+
+    async def admin_flow():
+        for _ in range(args.admin_rounds):
+            for label, upd in admin_round():
+                if upd is None:
+                    rows, _ = await main.db_list_pending_orders(limit=5)
+                    upd = text_update(ADMIN_ID, ",".join(str(r["id"]) for r in rows) or "0")
+                await feed(label, upd)
+            await asyncio.sleep(0)
+
+    # warm-up: keyboards, catalog, statement caches
+    for label, upd in funnel(99999, 0):
+        await main.dp.feed_update(bot, upd)
+    timings.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(admin_flow(), *(user_flow(i) for i in range(args.users)))
+    await main.EVENTS.close()  # admin and customer notifications queued on the event bus
+    if main._BACKGROUND_TASKS:
+        await asyncio.gather(*main._BACKGROUND_TASKS, return_exceptions=True)
+    wall = time.perf_counter() - start
+
+    total = sum(len(v) for v in timings.values())
+    print(f"users={args.users} concurrency={args.concurrency} admin_rounds={args.admin_rounds} "
+          f"latency={args.latency_ms}ms limiter={'on' if args.limiter else 'off'}")
+    print(f"{total} updates in {wall:.2f}s -> {total / wall:.0f} updates/s")
+    print(f"{'handler':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, values in sorted(timings.items()):
+        values.sort()
+        print(f"{label:<24}{len(values):>8}"
+              f"{percentile(values, 50) * 1e3:>10.2f}{percentile(values, 95) * 1e3:>10.2f}"
+              f"{percentile(values, 99) * 1e3:>10.2f}{values[-1] * 1e3:>10.2f}")
+    print(f"api calls: {dict(sorted(session.calls.items()))}")
+    print(f"write batches: {main.WRITES.stats()}")
+    if errors:
+        print(f"errors: {dict(errors)}")
+
+    await main.WRITES.close()
+    await main.SESSIONS.close()
+    main.db_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=500, help="synthetic customers, one funnel each")
+    parser.add_argument("--concurrency", type=int, default=50, help="customers in flight at once")
+    parser.add_argument("--admin-rounds", type=int, default=20, help="admin flow repetitions")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated Bot API round trip")
+    parser.add_argument("--limiter", action="store_true", help="keep the outbound rate limiter on")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""
+Orders query latency before/after the index migration (v3).
+
+    python bench/bench_orders_indexes.py [orders] [users]
+
+Builds a throw-away database with `orders` rows (default 1,000,000) spread
+over `users` users (~2% pending), migrated only up to v2, and times the
+order queries as the db_* helpers ran them at v3: page of a user's orders,
+COUNT(*) per user, pending page. Then it applies the index migration and
+times them again. Plain SQL on purpose: later helpers read tables (counters,
+archive) that a v2 schema does not have.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main
+
+INDEX_MIGRATION = 3
+
+def fill_orders(con, n: int, users: int):
+    rnd = random.Random(42)
+    services = [(plat, srv) for plat, srv_map in main.SERVICES.items() for srv in srv_map]
+    now = "2024-01-01T00:00:00"
+    batch = []
+    for _ in range(n):
+        plat, srv = rnd.choice(services)
+        status = "pending" if rnd.random() < 0.02 else rnd.choice(("done", "cancel"))
+        batch.append((rnd.randrange(users), plat, srv, 100, 150, status, now))
+        if len(batch) == 50000:
+            con.executemany("INSERT INTO orders(user_id, platform, service, qty, price, status, created_at) "
+                            "VALUES(?,?,?,?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        con.executemany("INSERT INTO orders(user_id, platform, service, qty, price, status, created_at) "
+                        "VALUES(?,?,?,?,?,?,?)", batch)
+
+QUERIES = {
+    "db_list_orders_by_user": ("SELECT id, platform, service, qty, price, status, created_at "
+                               "FROM orders WHERE user_id=? ORDER BY id DESC LIMIT ?", "user"),
+    "db_count_orders_by_user": ("SELECT COUNT(*) FROM orders WHERE user_id=?", "count"),
+    "db_list_pending_orders": ("SELECT id, user_id, platform, service, qty, price, status, created_at "
+                               "FROM orders WHERE status='pending' AND id>? ORDER BY id ASC LIMIT ?", "pending"),
+}
+
+def _params(kind: str, uid: int):
+    limit = main.ORDERS_PAGE_SIZE + 1
+    return {"user": (uid, limit), "count": (uid,), "pending": (0, limit)}[kind]
+
+async def timed(sql: str, params, repeat: int = 30) -> dict:
+    def q(con):
+        return con.execute(sql, params).fetchall()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await main.STORAGE.read(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"p50": statistics.median(samples), "p95": samples[int(len(samples) * 0.95) - 1]}
+
+async def measure(users: int) -> dict:
+    uid = users // 2
+    return {name: await timed(sql, _params(kind, uid)) for name, (sql, kind) in QUERIES.items()}
+
+async def amain(n: int, users: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    main.STORAGE = main.Storage(path, readers=2)
+    main.STORAGE.open()
+
+    t0 = time.perf_counter()
+    await main.STORAGE.write(main._migrate, INDEX_MIGRATION - 1)
+    await main.STORAGE.write(fill_orders, n, users)
+    print(f"filled {n} orders for {users} users in {time.perf_counter() - t0:.1f}s")
+
+    before = await measure(users)
+    t0 = time.perf_counter()
+    version = await main.STORAGE.write(main._migrate, INDEX_MIGRATION)
+    print(f"migrated to v{version} in {time.perf_counter() - t0:.1f}s")
+    after = await measure(users)
+    main.STORAGE.close()
+
+    print(f"{'query':26s} {'before p50/p95 ms':>20s} {'after p50/p95 ms':>20s} {'speedup':>8s}")
+    for name in before:
+        b, a = before[name], after[name]
+        print(f"{name:26s} {b['p50']:9.2f}/{b['p95']:<9.2f} {a['p50']:9.3f}/{a['p95']:<9.3f} "
+              f"{b['p50'] / a['p50']:7.0f}x")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    asyncio.run(amain(n, users))
@@ -1,17 +1,45 @@
 import os
 import re
+import secrets
+import signal
 import asyncio
+import bisect
+import csv
+import functools
+import html
+import io
+import contextvars
+import cProfile
+import heapq
+import itertools
+import json
 import logging
+import pstats
+import queue
 import sqlite3
-from datetime import datetime
-
-from aiogram import Bot, Dispatcher, F
+import string
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from enum import Enum
+
+from aiogram import Bot, Dispatcher, F, BaseMiddleware
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, Update,
     InlineKeyboardMarkup, InlineKeyboardButton,
+    BufferedInputFile,
 )
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientSession, ClientTimeout, web
 
 # ===================== CONFIG =====================
 BOT_TOKEN = (os.getenv("BOT_TOKEN") or "").strip()
@@ -19,10 +47,269 @@ ADMIN_IDS_RAW = (os.getenv("ADMIN_IDS") or "").strip()  # "123,456"
 ADMIN_IDS = {int(x) for x in ADMIN_IDS_RAW.split(",") if x.strip().isdigit()}
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "@BRILIANTEX").strip()  # visible in UI
 DB_PATH = "bot.db"
+BOT_MODE = (os.getenv("BOT_MODE") or "polling").strip().lower()  # polling | webhook
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()  # bind address
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8080)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or "").strip()  # public base URL, e.g. https://bot.example.com
+WEBHOOK_SECRET = (os.getenv("WEBHOOK_SECRET") or "").strip()  # X-Telegram-Bot-Api-Secret-Token
+DB_READERS = int(os.getenv("DB_READERS") or 4)  # long-lived reader connections
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE") or 10000)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL") or 600)  # seconds
+ADMIN_NOTIFY_CONCURRENCY = int(os.getenv("ADMIN_NOTIFY_CONCURRENCY") or 5)  # parallel receipt sends
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX") or 10000)  # events buffered per subscriber, then dropped
+NOTIFY_BATCH_WINDOW_MS = float(os.getenv("NOTIFY_BATCH_WINDOW_MS") or 1000)  # status changes merged per customer
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE") or 30)  # Bot API messages/sec, whole bot
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE") or 1)  # messages/sec per chat
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST") or 3)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES") or 3)  # retries after TelegramRetryAfter
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE") or 20000)  # messages whose last render is remembered
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL") or 86400)  # seconds
+SESSION_BACKEND = (os.getenv("SESSION_BACKEND") or "sqlite").strip().lower()  # sqlite | memory
+SESSION_TTL = float(os.getenv("SESSION_TTL") or 86400)  # idle seconds before a session is dropped
+SESSION_MAX = int(os.getenv("SESSION_MAX") or 50000)  # sessions kept in memory per kind
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL") or 1.0)  # sqlite batch interval
+# rows per page for "My orders" / pending list; capped so a page stays far below 4096 chars
+ORDERS_PAGE_SIZE = max(1, min(int(os.getenv("ORDERS_PAGE_SIZE") or 10), 25))
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS") or 1000)  # order ids per bulk done/cancel message
+BULK_UNDO_WINDOW = float(os.getenv("BULK_UNDO_WINDOW") or 300)  # seconds a bulk change can be undone
+PRICE_IMPORT_MAX_BYTES = int(os.getenv("PRICE_IMPORT_MAX_BYTES") or 256 * 1024)  # uploaded price file limit
+PRICE_IMPORT_TTL = float(os.getenv("PRICE_IMPORT_TTL") or 600)  # seconds to confirm an uploaded price file
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX") or 64)  # intents per group commit
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS") or 5)  # how long a batch waits to fill
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()  # Prometheus /metrics bind address
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 9101)  # 0 disables the endpoint
+SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS") or 500)  # updates at/over this go to SLOW_UPDATES
+SLOW_UPDATES_MAX = int(os.getenv("SLOW_UPDATES_MAX") or 200)  # ring buffer size
+PROFILE_TOP = int(os.getenv("PROFILE_TOP") or 40)  # rows per /profile and /memprof report
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES") or 1)  # tracemalloc stack depth
+LOG_FORMAT = (os.getenv("LOG_FORMAT") or "text").strip().lower()  # text | json (one object per line)
+# per-step span lines (handler, db_*, Bot API) with trace ids; on by default with json logs
+LOG_SPANS = (os.getenv("LOG_SPANS") or ("1" if LOG_FORMAT == "json" else "0")).strip() == "1"
+WORKERS = int(os.getenv("WORKERS") or 0)  # >0: ingress + N worker processes sharded by user id
+SHARD_INDEX = int(os.getenv("SHARD_INDEX") or -1)  # set by the supervisor in worker processes only
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT") or 8600)  # worker i listens on 127.0.0.1:base+i
+SHARD_QUEUE_MAX = int(os.getenv("SHARD_QUEUE_MAX") or 1000)  # updates buffered per worker
+SHARD_LANES = int(os.getenv("SHARD_LANES") or 16)  # in-flight updates per worker; a user always uses one lane
+SHARD_REPORT_INTERVAL = float(os.getenv("SHARD_REPORT_INTERVAL") or 60)  # seconds between load reports
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL") or 2)  # workers poll meta.price_rev
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS") or 30)  # orders done/cancelled this long ago -> archive; 0 = off
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH") or 500)  # orders moved per write transaction
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL") or 3600)  # seconds between archival runs
+ARCHIVE_PAUSE_MS = float(os.getenv("ARCHIVE_PAUSE_MS") or 50)  # gap between batches, lets other writes in
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES") or 1000)  # free pages returned per incremental_vacuum
+# "1": switch an existing bot.db to auto_vacuum=INCREMENTAL at startup (one full, blocking VACUUM)
+DB_VACUUM_ON_START = (os.getenv("DB_VACUUM_ON_START") or "").strip() == "1"
+I18N_DIR = (os.getenv("I18N_DIR") or "").strip()  # optional dir with extra <lang>.json files
+I18N_STRICT = (os.getenv("I18N_STRICT") or "").strip() == "1"  # fail startup on i18n problems
 
 # ===================== LOGGING =====================
-logging.basicConfig(level=logging.INFO)
+
+class UpdateTrace:
+    """One update: its correlation id and where its time went (filled by the instrumentation)."""
+    __slots__ = ("trace_id", "update_id", "kind", "data", "handler", "started",
+                 "db", "db_calls", "api", "api_calls")
+
+    def __init__(self, update_id: int, kind: str, data: str):
+        self.trace_id = f"{update_id:x}-{secrets.token_hex(4)}"
+        self.update_id, self.kind, self.data = update_id, kind, data
+        self.handler = "-"
+        self.started = time.perf_counter()
+        self.db = self.api = 0.0
+        self.db_calls = self.api_calls = 0
+
+    def finish(self) -> dict:
+        total = time.perf_counter() - self.started
+        return {
+            "at": time.time(), "trace_id": self.trace_id, "update_id": self.update_id, "kind": self.kind,
+            "data": self.data, "handler": self.handler, "total": total, "db": self.db, "db_calls": self.db_calls,
+            "api": self.api, "api_calls": self.api_calls, "other": max(0.0, total - self.db - self.api),
+        }
+
+# trace of the update being handled; background tasks spawned from it inherit it
+UPDATE_TRACE = contextvars.ContextVar("update_trace", default=None)
+
+class TraceIdFilter(logging.Filter):
+    # stamps every record (ours and aiogram's) with the current update's trace id (and worker index)
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = UPDATE_TRACE.get()
+        record.trace_id = trace.trace_id if trace is not None else None
+        if SHARD_INDEX >= 0:
+            record.shard = SHARD_INDEX
+        return True
+
+_LOG_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, trace_id + any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_log_handler = logging.StreamHandler()
+_log_handler.addFilter(TraceIdFilter())
+if LOG_FORMAT == "json":
+    _log_handler.setFormatter(JsonLogFormatter())
+elif SHARD_INDEX >= 0:
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:w%(shard)s:%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
 logger = logging.getLogger("smm_bot")
+span_logger = logging.getLogger("smm_bot.span")
+
+def log_span(span: str, name: str, start: float, elapsed: float, ok: bool = True, **fields):
+    """
+    One timed step of the current update (handler, db_* call, Bot API request),
+    as a log line carrying the trace id. `at_ms` is the offset from the start of
+    the update, which is what tools/trace_timeline.py lays out.
+    """
+    if not LOG_SPANS:
+        return
+    trace = UPDATE_TRACE.get()
+    at_ms = round((start - trace.started) * 1000, 3) if trace is not None else None
+    span_logger.info(f"{span} {name} {elapsed * 1000:.1f} ms", extra={
+        "span": span, "op": name, "at_ms": at_ms, "dur_ms": round(elapsed * 1000, 3), "ok": ok, **fields,
+    })
+
+# ===================== Metrics =====================
+
+# seconds; Telegram calls and handlers live in the 5 ms .. 10 s range, SQLite well below
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames=()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label tuple (Prometheus semantics)."""
+
+    def __init__(self, name: str, doc: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for labels, series in sorted(self._series.items()):
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                total += n
+                yield f"{self.name}_bucket{_labels(names, labels + (bound,))} {total}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {total}"
+
+class Gauge:
+    """
+    Read at scrape time: `fn` returns a number or {label tuple: number}.
+    kind="counter" for values some other object already counts monotonically.
+    """
+
+    def __init__(self, name: str, doc: str, fn, labelnames=(), kind: str = "gauge"):
+        self.name, self.doc, self.fn, self.labelnames, self.kind = name, doc, fn, tuple(labelnames), kind
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in sorted(items):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {v}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, doc: str, labelnames=()) -> Counter:
+        return self._add(Counter(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labelnames, buckets))
+
+    def gauge(self, name: str, doc: str, fn, labelnames=(), kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(name, doc, fn, labelnames, kind))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # a broken gauge must not take the whole scrape down
+                logger.warning(f"Metric {metric.name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+HANDLER_SECONDS = METRICS.histogram("bot_handler_seconds", "Handler run time", ("handler",))
+HANDLER_ERRORS = METRICS.counter("bot_handler_errors_total", "Handlers that raised", ("handler", "error"))
+DB_SECONDS = METRICS.histogram("bot_db_seconds", "db_* call time, incl. executor wait", ("query",))
+DB_ERRORS = METRICS.counter("bot_db_errors_total", "db_* calls that raised", ("query", "error"))
+API_SECONDS = METRICS.histogram("bot_api_seconds", "Bot API request time, after rate limiting", ("method",))
+API_ERRORS = METRICS.counter("bot_api_errors_total", "Bot API requests that raised", ("method", "error"))
+
+def db_timed(fn):
+    # times an async db_* helper into DB_SECONDS / DB_ERRORS under its own name
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        ok = True
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            ok = False
+            DB_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_SECONDS.observe(elapsed, name)
+            log_span("db", name, start, elapsed, ok)
+            trace = UPDATE_TRACE.get()
+            if trace is not None:
+                trace.db += elapsed
+                trace.db_calls += 1
+    return wrapper
 
 # ===================== i18n =====================
 
@@ -89,9 +376,14 @@ I18N = {
         ),
         "check_received": "✅ Принято! Я отправил чек администратору. Ваш заказ в статусе <b>pending</b>.",
         "need_check_first": "⚠️ Сначала выберите пакет, затем отправляйте чек/скрин.",
+        "proof_duplicate": "⚠️ Этот чек уже был отправлен (заказ <b>#{id}</b>). Новый заказ не создан — отправьте чек именно этой оплаты.",
         "my_orders_empty": "🧾 У вас пока нет заказов.",
         "my_orders_title": "🧾 Ваши заказы:",
         "order_row": "🆔 #{id} • {platform} / {service} / {qty} • <b>{status}</b>",
+        "order_status_changed": "🔔 Статус заказа обновлён:",
+        "order_status_more": "…и ещё {count}",
+        "page_prev": "◀️ Назад",
+        "page_next": "Далее ▶️",
 
         "faq_text": (
             "❓ <b>FAQ</b>\n\n"
@@ -114,16 +406,55 @@ I18N = {
         "admin_btn_done": "✅ Сделать Done",
         "admin_btn_cancel": "❌ Сделать Cancel",
         "admin_btn_prices": "💸 Редактировать цены",
+        "admin_btn_stats": "📊 Статистика",
+        "admin_btn_import": "📥 Импорт/экспорт цен",
+        "admin_import_help": (
+            "📥 <b>Импорт цен</b>\n\n"
+            "Ниже — текущий прайс (CSV). Отредактируйте его и отправьте файлом сюда.\n"
+            "Колонки: <code>platform,service,qty,price</code>. Строки, которых нет в файле, будут удалены.\n"
+            "Также принимается JSON (<code>/prices_export json</code>).\n"
+            "Перед применением я покажу список изменений."
+        ),
+        "admin_import_errors": "⚠️ Файл не принят, ошибок: {count}\n{errors}",
+        "admin_import_nochange": "ℹ️ В файле нет изменений.",
+        "admin_import_diff": "🧾 Изменения: +{added} / ~{changed} / -{removed}\n\n<code>{lines}</code>\n\nПрименить?",
+        "btn_apply": "✅ Применить",
+        "btn_cancel": "✖️ Отмена",
+        "admin_import_applied": "✅ Прайс обновлён: {count} изменений (версия {version}).",
+        "admin_import_stale": "⚠️ Цены изменились после загрузки файла. Отправьте файл заново.",
+        "admin_import_cancelled": "✖️ Импорт отменён.",
+        "admin_import_expired": "⌛️ Импорт устарел. Отправьте файл заново.",
+        "admin_stats_text": (
+            "📊 <b>Заказы</b>\n"
+            "• pending: <b>{pending}</b>\n"
+            "• done: <b>{done}</b>\n"
+            "• cancel: <b>{cancel}</b>\n"
+            "• всего: <b>{total}</b>"
+        ),
+        "admin_recount_ok": "✅ Счётчики заказов совпадают с таблицей orders.",
+        "admin_recount_fixed": "🛠 Счётчики пересчитаны. Расхождения: пользователей — {users}, статусы — {statuses}",
+        "admin_slow_empty": "✅ Медленных апдейтов (≥ {ms} мс) пока не было.",
+        "admin_prof_usage": "Использование: <code>/profile start|stop</code> (CPU), <code>/memprof start|stop</code> (память), <code>/slow</code>",
+        "admin_prof_started": "⏺ {name} запущен. Остановить и получить отчёт: <code>/{name} stop</code>",
+        "admin_prof_already": "ℹ️ {name} уже запущен.",
+        "admin_prof_idle": "ℹ️ {name} не запущен.",
 
         "admin_pending_empty": "📦 Pending-заказов нет.",
         "admin_pending_title": "📦 Pending заказы:\n\n{rows}",
         "admin_pending_row": "🆔 #{id} | {user_id} | {platform}/{service}/{qty} | {price}₸ | {status}",
 
-        "admin_ask_order_id_done": "Введите ID заказа, который нужно отметить как ✅ done (пример: 12)",
-        "admin_ask_order_id_cancel": "Введите ID заказа, который нужно отметить как ❌ cancel (пример: 12)",
+        "admin_ask_order_id_done": "Введите ID заказов, которые нужно отметить как ✅ done (пример: 12 или 12,15,20-80)",
+        "admin_ask_order_id_cancel": "Введите ID заказов, которые нужно отметить как ❌ cancel (пример: 12 или 12,15,20-80)",
         "admin_done_ok": "✅ Готово. Заказ #{id} отмечен как done.",
         "admin_cancel_ok": "❌ Готово. Заказ #{id} отмечен как cancel.",
         "admin_bad_id": "⚠️ Неверный ID. Попробуйте ещё раз.",
+        "admin_bulk_title": "🗂 <b>{status}</b>: изменено {updated} из {total}",
+        "admin_bulk_updated": "✅ Изменены: {ids}",
+        "admin_bulk_unchanged": "⏭ Уже {status}: {ids}",
+        "admin_bulk_missing": "⚠️ Не найдены: {ids}",
+        "btn_undo": "↩️ Отменить",
+        "admin_undo_ok": "↩️ Отменено: возвращено {count} из {total}.",
+        "admin_undo_expired": "⌛️ Отменить уже нельзя.",
 
         "admin_prices_help": (
             "💸 <b>Редактирование цен</b>\n\n"
@@ -203,9 +534,14 @@ I18N = {
         ),
         "check_received": "✅ Қабылданды! Чек админге жіберілді. Тапсырысыңыз <b>pending</b> статусында.",
         "need_check_first": "⚠️ Алдымен пакет таңдаңыз, содан кейін чек/скрин жіберіңіз.",
+        "proof_duplicate": "⚠️ Бұл чек бұрын жіберілген (тапсырыс <b>#{id}</b>). Жаңа тапсырыс ашылмады — осы төлемнің чегін жіберіңіз.",
         "my_orders_empty": "🧾 Сізде әзірге тапсырыс жоқ.",
         "my_orders_title": "🧾 Сіздің тапсырыстарыңыз:",
         "order_row": "🆔 #{id} • {platform} / {service} / {qty} • <b>{status}</b>",
+        "order_status_changed": "🔔 Тапсырыс статусы жаңартылды:",
+        "order_status_more": "…тағы {count}",
+        "page_prev": "◀️ Артқа",
+        "page_next": "Әрі қарай ▶️",
 
         "faq_text": (
             "❓ <b>FAQ</b>\n\n"
@@ -228,16 +564,55 @@ I18N = {
         "admin_btn_done": "✅ Done жасау",
         "admin_btn_cancel": "❌ Cancel жасау",
         "admin_btn_prices": "💸 Бағаны өзгерту",
+        "admin_btn_stats": "📊 Статистика",
+        "admin_btn_import": "📥 Бағаларды импорт/экспорт",
+        "admin_import_help": (
+            "📥 <b>Бағаларды импорттау</b>\n\n"
+            "Төменде — ағымдағы прайс (CSV). Оны өңдеп, осында файл ретінде жіберіңіз.\n"
+            "Бағандар: <code>platform,service,qty,price</code>. Файлда жоқ жолдар өшіріледі.\n"
+            "JSON да қабылданады (<code>/prices_export json</code>).\n"
+            "Қолданар алдында өзгерістер тізімін көрсетемін."
+        ),
+        "admin_import_errors": "⚠️ Файл қабылданбады, қателер: {count}\n{errors}",
+        "admin_import_nochange": "ℹ️ Файлда өзгеріс жоқ.",
+        "admin_import_diff": "🧾 Өзгерістер: +{added} / ~{changed} / -{removed}\n\n<code>{lines}</code>\n\nҚолдану керек пе?",
+        "btn_apply": "✅ Қолдану",
+        "btn_cancel": "✖️ Бас тарту",
+        "admin_import_applied": "✅ Прайс жаңартылды: {count} өзгеріс (нұсқа {version}).",
+        "admin_import_stale": "⚠️ Файл жүктелгеннен кейін бағалар өзгерді. Файлды қайта жіберіңіз.",
+        "admin_import_cancelled": "✖️ Импорт тоқтатылды.",
+        "admin_import_expired": "⌛️ Импорт ескірді. Файлды қайта жіберіңіз.",
+        "admin_stats_text": (
+            "📊 <b>Тапсырыстар</b>\n"
+            "• pending: <b>{pending}</b>\n"
+            "• done: <b>{done}</b>\n"
+            "• cancel: <b>{cancel}</b>\n"
+            "• барлығы: <b>{total}</b>"
+        ),
+        "admin_recount_ok": "✅ Тапсырыс санағыштары orders кестесімен сәйкес.",
+        "admin_recount_fixed": "🛠 Санағыштар қайта есептелді. Айырма: қолданушылар — {users}, статустар — {statuses}",
+        "admin_slow_empty": "✅ Баяу апдейттер (≥ {ms} мс) әзірге болған жоқ.",
+        "admin_prof_usage": "Қолдану: <code>/profile start|stop</code> (CPU), <code>/memprof start|stop</code> (жады), <code>/slow</code>",
+        "admin_prof_started": "⏺ {name} іске қосылды. Тоқтатып, есеп алу: <code>/{name} stop</code>",
+        "admin_prof_already": "ℹ️ {name} қазір жұмыс істеп тұр.",
+        "admin_prof_idle": "ℹ️ {name} іске қосылмаған.",
 
         "admin_pending_empty": "📦 Pending тапсырыс жоқ.",
         "admin_pending_title": "📦 Pending тапсырыстар:\n\n{rows}",
         "admin_pending_row": "🆔 #{id} | {user_id} | {platform}/{service}/{qty} | {price}₸ | {status}",
 
-        "admin_ask_order_id_done": "✅ done ету үшін тапсырыс ID жіберіңіз (мысалы: 12)",
-        "admin_ask_order_id_cancel": "❌ cancel ету үшін тапсырыс ID жіберіңіз (мысалы: 12)",
+        "admin_ask_order_id_done": "✅ done ету үшін тапсырыс ID жіберіңіз (мысалы: 12 немесе 12,15,20-80)",
+        "admin_ask_order_id_cancel": "❌ cancel ету үшін тапсырыс ID жіберіңіз (мысалы: 12 немесе 12,15,20-80)",
         "admin_done_ok": "✅ Дайын. #{id} тапсырыс done болды.",
         "admin_cancel_ok": "❌ Дайын. #{id} тапсырыс cancel болды.",
         "admin_bad_id": "⚠️ ID қате. Қайта көріңіз.",
+        "admin_bulk_title": "🗂 <b>{status}</b>: {total} ішінен {updated} өзгертілді",
+        "admin_bulk_updated": "✅ Өзгертілді: {ids}",
+        "admin_bulk_unchanged": "⏭ Бұрыннан {status}: {ids}",
+        "admin_bulk_missing": "⚠️ Табылмады: {ids}",
+        "btn_undo": "↩️ Болдырмау",
+        "admin_undo_ok": "↩️ Болдырылмады: {total} ішінен {count} қайтарылды.",
+        "admin_undo_expired": "⌛️ Енді болдырмау мүмкін емес.",
 
         "admin_prices_help": (
             "💸 <b>Бағаны өзгерту</b>\n\n"
@@ -252,12 +627,98 @@ I18N = {
     }
 }
 
-def t(lang: str, key: str, **kwargs) -> str:
-    lang = lang if lang in I18N else "ru"
-    text = I18N[lang].get(key, key)
-    if kwargs:
-        return text.format(**kwargs)
-    return text
+DEFAULT_LANG = "ru"  # reference language: validation baseline and fallback
+
+_FORMATTER = string.Formatter()
+
+def i18n_load_dir(path: str):
+    """
+    Merge <lang>.json files from `path` into I18N (new languages or overrides).
+    Runs once at import, before compilation, so it adds no per-call cost.
+    """
+    for name in sorted(os.listdir(path)):
+        code, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        with open(os.path.join(path, name), encoding="utf-8") as fh:
+            data = json.load(fh)
+        if not isinstance(data, dict) or not all(isinstance(v, str) for v in data.values()):
+            raise ValueError(f"i18n file {name}: expected a flat JSON object of strings")
+        I18N.setdefault(code, {}).update(data)
+        logger.info(f"i18n: loaded {len(data)} strings for '{code}' from {name}")
+
+def _compile_template(text: str):
+    """
+    Constant strings compile to themselves. Templates with plain {name}
+    fields compile to a %-style string (cheapest formatting in CPython);
+    anything fancier ({x!r}, {x:>5}, {a.b}) keeps str.format_map.
+    Returns (compiled, field_names).
+    """
+    literal_parts = []
+    pct_parts = []
+    fields = set()
+    simple = True
+    for literal, field, spec, conv in _FORMATTER.parse(text):
+        literal_parts.append(literal)
+        pct_parts.append(literal.replace("%", "%%"))
+        if field is None:
+            continue
+        if spec or conv or not field.isidentifier():
+            simple = False
+        fields.add(field)
+        pct_parts.append(f"%({field})s")
+    if not fields:
+        return "".join(literal_parts), fields
+    render = "".join(pct_parts).__mod__ if simple else text.format_map
+    return (text, render), fields
+
+def i18n_compile():
+    """
+    Pre-parse every I18N string and check each language against DEFAULT_LANG.
+    Keys missing in a language fall back to the DEFAULT_LANG string; missing
+    keys and mismatched placeholders are reported here, at startup.
+    """
+    compiled = {}
+    fields = {}
+    for lang, table in I18N.items():
+        compiled[lang] = {}
+        fields[lang] = {}
+        for key, text in table.items():
+            compiled[lang][key], fields[lang][key] = _compile_template(text)
+
+    problems = []
+    base = fields[DEFAULT_LANG]
+    for lang in I18N:
+        if lang == DEFAULT_LANG:
+            continue
+        for key in base.keys() - fields[lang].keys():
+            problems.append(f"[{lang}] missing key '{key}'")
+            compiled[lang][key] = compiled[DEFAULT_LANG][key]
+        for key in fields[lang].keys() - base.keys():
+            problems.append(f"[{lang}] unknown key '{key}'")
+        for key in base.keys() & fields[lang].keys():
+            if base[key] != fields[lang][key]:
+                problems.append(f"[{lang}] placeholders of '{key}' differ: "
+                                f"{sorted(fields[lang][key])} vs {sorted(base[key])} in '{DEFAULT_LANG}'")
+    for p in sorted(problems):
+        logger.warning(f"i18n: {p}")
+    if problems and I18N_STRICT:
+        raise RuntimeError(f"i18n validation failed: {len(problems)} problem(s)")
+    return compiled
+
+if I18N_DIR:
+    i18n_load_dir(I18N_DIR)
+_I18N_COMPILED = i18n_compile()
+
+def t(lang: str, key: str, /, **kwargs) -> str:
+    table = _I18N_COMPILED.get(lang) or _I18N_COMPILED[DEFAULT_LANG]
+    tpl = table.get(key)
+    if tpl is None:
+        return key
+    if tpl.__class__ is str:
+        return tpl
+    # (raw template, compiled formatter)
+    return tpl[1](kwargs) if kwargs else tpl[0]
 
 # ===================== CATALOG (services & default prices) =====================
 
@@ -313,18 +774,304 @@ DEFAULT_PRICES = {
     "tg_reacts": {100: 200, 500: 900, 1000: 1600},
 }
 
+# ===================== Caches =====================
+
+MISSING = object()
+
+class LRUCache:
+    """
+    Bounded LRU mapping with a per-entry TTL.
+    Expired entries are dropped on access, the least recently used entry is
+    evicted once `maxsize` is reached. Hit/miss counters are kept for stats.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+# user_id -> stored lang (None = no users row yet)
+LANG_CACHE = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+class PriceCatalog:
+    """
+    Immutable snapshot of the `prices` table.
+    Never mutated after construction: a price change builds a new snapshot
+    and swaps the module-level CATALOG reference. `version` grows with every
+    swap so dependent caches can tell when they are stale. `version` is local
+    to this process, `rev` is the database-wide price revision.
+    """
+    __slots__ = ("version", "rev", "_prices", "_packs")
+
+    def __init__(self, version: int, rows, rev: int = 0):
+        prices = {}
+        packs = {}
+        for plat, srv, qty, price in rows:
+            prices[(plat, srv, int(qty))] = int(price)
+            packs.setdefault((plat, srv), []).append((int(qty), int(price)))
+        self.version = version
+        self.rev = rev  # meta.price_rev the rows were read at
+        self._prices = prices
+        self._packs = {k: tuple(sorted(v)) for k, v in packs.items()}
+
+    def price(self, platform: str, service: str, qty: int):
+        return self._prices.get((platform, service, qty))
+
+    def packs(self, platform: str, service: str) -> tuple:
+        return self._packs.get((platform, service), ())
+
+    def items(self) -> dict:
+        # copy of {(platform, service, qty): price}
+        return dict(self._prices)
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+CATALOG = PriceCatalog(0, ())
+
 # ===================== DB =====================
 
-def db_connect():
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
+class Storage:
+    """
+    Async access to SQLite without blocking the event loop.
+    One dedicated writer connection (single thread -> writes are serialized)
+    plus a small pool of long-lived reader connections. Every query runs on a
+    thread executor, handlers just `await` the db_* helpers.
+    """
 
-def db_init():
-    con = db_connect()
-    cur = con.cursor()
+    def __init__(self, path: str, readers: int = 4):
+        self.path = path
+        self.readers = max(1, readers)
+        self._writer = None
+        self._reader_cons = []
+        self._idle = queue.SimpleQueue()
+        self._write_exec = None
+        self._read_exec = None
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA synchronous=NORMAL")  # durable enough with WAL, one fsync per checkpoint
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA cache_size=-16000")  # ~16 MB page cache per connection
+        return con
+
+    def open(self):
+        if self._writer is not None:
+            return
+        self._writer = self._connect()
+        # only takes effect on a new file, before WAL writes its header (see _enable_incremental_vacuum)
+        self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL: readers never block the writer and vice versa; persists in the db file
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        for _ in range(self.readers):
+            con = self._connect()
+            con.execute("PRAGMA query_only=ON")
+            self._reader_cons.append(con)
+            self._idle.put(con)
+        self._write_exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._read_exec = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._write_exec.shutdown(wait=True)
+        self._read_exec.shutdown(wait=True)
+        for con in self._reader_cons:
+            con.close()
+        self._writer.close()
+        self._writer = None
+        self._reader_cons = []
+        self._idle = queue.SimpleQueue()
+
+    def _run_read(self, fn, args):
+        # pool size == reader threads, so a connection is always free here
+        con = self._idle.get()
+        try:
+            return fn(con, *args)
+        finally:
+            self._idle.put(con)
 
-    cur.execute("""
+    def _run_write(self, fn, args):
+        con = self._writer
+        try:
+            result = fn(con, *args)
+            con.commit()
+            return result
+        except Exception:
+            con.rollback()
+            raise
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_exec, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_exec, self._run_write, fn, args)
+
+STORAGE = Storage(DB_PATH, readers=DB_READERS)
+
+async def drain_batches(q: asyncio.Queue, max_items: int, window: float):
+    """
+    Yield lists of up to `max_items` items from `q`, each gathered for at most
+    `window` seconds after its first item arrived. A None item is the stop
+    sentinel: the items queued before it are still yielded, then it returns.
+    """
+    loop = asyncio.get_running_loop()
+    stop = False
+    while not stop:
+        item = await q.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = loop.time() + window
+        while len(batch) < max_items:
+            try:
+                item = q.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(q.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        yield batch
+
+class WriteCoalescer:
+    """
+    Group commit for hot single-row writes (new orders, user upserts).
+    Callers `await submit(fn, *args)`; a single task collects intents for up to
+    `window` seconds or `max_items` entries and runs them on the writer
+    connection in one transaction, i.e. one commit/fsync per batch instead of
+    one per write. Each intent runs under its own SAVEPOINT, so a failing one
+    only fails its own caller. The future resolves with fn's return value.
+    """
+
+    def __init__(self, storage: Storage, max_items: int, window: float):
+        self.storage = storage
+        self.max_items = max(1, max_items)
+        self.window = max(0.0, window)
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # sentinel: everything queued before it is still committed
+        task, self._task = self._task, None  # later submits go straight to the writer
+        if task is not None:
+            self._queue.put_nowait(None)
+            await task
+
+    async def submit(self, fn, *args):
+        if self._task is None:
+            # not started (scripts, shutdown): plain write
+            return await self.storage.write(fn, *args)
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, fut))
+        return await fut
+
+    @staticmethod
+    def _apply(con: sqlite3.Connection, batch):
+        if not con.in_transaction:
+            con.execute("BEGIN IMMEDIATE")
+        results = []
+        for fn, args, _ in batch:
+            con.execute("SAVEPOINT intent")
+            try:
+                results.append((True, fn(con, *args)))
+                con.execute("RELEASE intent")
+            except Exception as e:
+                con.execute("ROLLBACK TO intent")
+                con.execute("RELEASE intent")
+                results.append((False, e))
+        return results
+
+    async def _run(self):
+        async for batch in drain_batches(self._queue, self.max_items, self.window):
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            results = await self.storage.write(self._apply, batch)
+        except Exception as e:
+            # commit itself failed: nothing in the batch was written
+            logger.warning(f"Write batch of {len(batch)} failed: {e}")
+            results = [(False, e)] * len(batch)
+        self.batches += 1
+        self.items += len(batch)
+        self.largest = max(self.largest, len(batch))
+        for (_, _, fut), (ok, value) in zip(batch, results):
+            if fut.done():
+                continue  # caller went away, the row is written anyway
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+    def stats(self) -> dict:
+        avg = self.items / self.batches if self.batches else 0.0
+        return {"batches": self.batches, "items": self.items, "avg_batch": round(avg, 2),
+                "largest": self.largest, "queued": self._queue.qsize() if self._queue else 0}
+
+WRITES = WriteCoalescer(STORAGE, WRITE_BATCH_MAX, WRITE_BATCH_WINDOW_MS / 1000)
+
+# ----- schema migrations -----
+# Append new steps at the end, never edit or reorder applied ones.
+# Each step runs in its own transaction together with its schema_version row.
+
+def _m001_base_tables(con: sqlite3.Connection):
+    # IF NOT EXISTS: databases created before versioning adopt this step as-is
+    con.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
         lang TEXT NOT NULL DEFAULT 'ru',
@@ -332,7 +1079,7 @@ def db_init():
     )
     """)
 
-    cur.execute("""
+    con.execute("""
     CREATE TABLE IF NOT EXISTS prices (
         platform TEXT NOT NULL,
         service TEXT NOT NULL,
@@ -342,7 +1089,7 @@ def db_init():
     )
     """)
 
-    cur.execute("""
+    con.execute("""
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -357,7 +1104,210 @@ def db_init():
     )
     """)
 
+def _m002_sessions(con: sqlite3.Connection):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        kind TEXT NOT NULL,
+        key INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (kind, key)
+    ) WITHOUT ROWID
+    """)
+
+def _m003_orders_indexes(con: sqlite3.Connection):
+    # "My orders": WHERE user_id=? ORDER BY id DESC, and COUNT(*) per user
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id, id)")
+    # admin pending list: WHERE status='pending' ORDER BY id
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id)")
+    con.execute("ANALYZE orders")
+
+def _m004_order_counters(con: sqlite3.Connection):
+    # denormalized counters, kept exact by triggers in the same transaction as the order write
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS user_order_counts (
+        user_id INTEGER PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS order_status_counts (
+        status TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_counters_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT INTO user_order_counts(user_id, orders) VALUES (NEW.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET orders = orders + 1;
+        INSERT INTO order_status_counts(status, orders) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET orders = orders + 1;
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_counters_status AFTER UPDATE OF status ON orders
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE order_status_counts SET orders = orders - 1 WHERE status = OLD.status;
+        INSERT INTO order_status_counts(status, orders) VALUES (NEW.status, 1)
+            ON CONFLICT(status) DO UPDATE SET orders = orders + 1;
+    END
+    """)
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_counters_delete AFTER DELETE ON orders
+    BEGIN
+        UPDATE user_order_counts SET orders = orders - 1 WHERE user_id = OLD.user_id;
+        UPDATE order_status_counts SET orders = orders - 1 WHERE status = OLD.status;
+    END
+    """)
+    _rebuild_order_counters(con)
+
+def _m005_price_revision(con: sqlite3.Connection):
+    # bumped by every write to `prices`, so other processes can tell their CATALOG is stale
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    con.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('price_rev', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        con.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_prices_rev_{event.lower()} AFTER {event} ON prices
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'price_rev';
+        END
+        """)
+
+def _m006_order_idempotency(con: sqlite3.Connection):
+    # "<chat_id>:<message_id>" of the receipt message: a redelivered update maps to the same order
+    con.execute("ALTER TABLE orders ADD COLUMN source_key TEXT")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_source_key ON orders(source_key) "
+                "WHERE source_key IS NOT NULL")
+    # one row per receipt file ever accepted; the PK makes a re-used receipt an index lookup
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS receipts (
+        file_unique_id TEXT PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def _m007_orders_archive(con: sqlite3.Connection):
+    # terminal orders moved out of the hot table by the archiver; ids are kept, so receipts still match
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        platform TEXT NOT NULL,
+        service TEXT NOT NULL,
+        qty INTEGER NOT NULL,
+        price INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        proof_file_id TEXT,
+        proof_type TEXT,
+        source_key TEXT,
+        archived_at TEXT NOT NULL
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_user_id ON orders_archive(user_id, id)")
+    # a deleted row that is already in the archive was moved, not removed: counters stay as they are
+    con.execute("DROP TRIGGER IF EXISTS trg_orders_counters_delete")
+    con.execute("""
+    CREATE TRIGGER trg_orders_counters_delete AFTER DELETE ON orders
+    WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = OLD.id)
+    BEGIN
+        UPDATE user_order_counts SET orders = orders - 1 WHERE user_id = OLD.user_id;
+        UPDATE order_status_counts SET orders = orders - 1 WHERE status = OLD.status;
+    END
+    """)
+
+def _m008_order_status_time(con: sqlite3.Connection):
+    # when the order reached its current status; the archiver ages done/cancel orders by it
+    con.execute("ALTER TABLE orders ADD COLUMN status_at TEXT")
+    con.execute("ALTER TABLE orders_archive ADD COLUMN status_at TEXT")
+    # best known value for orders that already left pending
+    con.execute("UPDATE orders SET status_at = created_at WHERE status != 'pending'")
+    con.execute("UPDATE orders_archive SET status_at = created_at")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_at ON orders(status, status_at)")
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_status_at AFTER UPDATE OF status ON orders
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE orders SET status_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE id = NEW.id;
+    END
+    """)
+
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "sessions table", _m002_sessions),
+    (3, "orders indexes", _m003_orders_indexes),
+    (4, "order counters", _m004_order_counters),
+    (5, "price revision", _m005_price_revision),
+    (6, "order idempotency", _m006_order_idempotency),
+    (7, "orders archive", _m007_orders_archive),
+    (8, "order status time", _m008_order_status_time),
+]
+
+def _migrate(con: sqlite3.Connection, target: int = None) -> int:
+    """Apply pending MIGRATIONS up to `target` (default: all). Returns the schema version."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+    current = con.execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_version").fetchone()["v"]
+    for version, name, step in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            step(con)
+            con.execute("INSERT INTO schema_version(version, name, applied_at) VALUES(?,?,?)",
+                        (version, name, datetime.utcnow().isoformat()))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        logger.info(f"DB migrated to v{version}: {name}")
+        current = version
+    return current
+
+def _rebuild_order_counters(con: sqlite3.Connection) -> dict:
+    """
+    Recount both counter tables from `orders` + `orders_archive` and overwrite them.
+    Returns the drift that was fixed: {"users": n, "statuses": {status: stored - actual}}.
+    """
+    src = "orders"
+    # migrations before v7 run this without the archive table
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='orders_archive'").fetchone():
+        src = "(SELECT user_id, status FROM orders UNION ALL SELECT user_id, status FROM orders_archive)"
+    actual_users = dict(con.execute(f"SELECT user_id, COUNT(*) FROM {src} GROUP BY user_id").fetchall())
+    stored_users = dict(con.execute("SELECT user_id, orders FROM user_order_counts").fetchall())
+    actual_status = dict(con.execute(f"SELECT status, COUNT(*) FROM {src} GROUP BY status").fetchall())
+    stored_status = dict(con.execute("SELECT status, orders FROM order_status_counts").fetchall())
+
+    drift_users = sum(1 for uid in actual_users.keys() | stored_users.keys()
+                      if actual_users.get(uid, 0) != stored_users.get(uid, 0))
+    drift_status = {st: stored_status.get(st, 0) - actual_status.get(st, 0)
+                    for st in actual_status.keys() | stored_status.keys()
+                    if actual_status.get(st, 0) != stored_status.get(st, 0)}
+    if drift_users:
+        con.execute("DELETE FROM user_order_counts")
+        con.executemany("INSERT INTO user_order_counts(user_id, orders) VALUES(?,?)", actual_users.items())
+    if drift_status:
+        con.execute("DELETE FROM order_status_counts")
+        con.executemany("INSERT INTO order_status_counts(status, orders) VALUES(?,?)", actual_status.items())
+    return {"users": drift_users, "statuses": drift_status}
+
+def _seed_prices(con: sqlite3.Connection):
     # seed prices if empty
+    cur = con.cursor()
     cur.execute("SELECT COUNT(*) AS c FROM prices")
     if cur.fetchone()["c"] == 0:
         for plat, srv_map in SERVICES.items():
@@ -370,115 +1320,387 @@ def db_init():
                         (plat, srv, qty, price)
                     )
 
-    con.commit()
-    con.close()
-
-def db_get_lang(user_id: int) -> str:
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("SELECT lang FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    con.close()
-    return row["lang"] if row else "ru"
-
-def db_upsert_user(user_id: int, lang: str):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("""
-        INSERT INTO users(user_id, lang, created_at)
-        VALUES(?,?,?)
-        ON CONFLICT(user_id) DO UPDATE SET lang=excluded.lang
-    """, (user_id, lang, datetime.utcnow().isoformat()))
-    con.commit()
-    con.close()
-
-def db_get_price(platform: str, service: str, qty: int) -> int:
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("SELECT price FROM prices WHERE platform=? AND service=? AND qty=?", (platform, service, qty))
-    row = cur.fetchone()
-    con.close()
-    if row:
-        return int(row["price"])
-    # fallback
-    return int(DEFAULT_PRICES.get(service, {}).get(qty, 0))
-
-def db_list_packs(platform: str, service: str):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("SELECT qty, price FROM prices WHERE platform=? AND service=? ORDER BY qty ASC", (platform, service))
-    rows = cur.fetchall()
-    con.close()
-    if rows:
-        return [(int(r["qty"]), int(r["price"])) for r in rows]
-    # fallback
+def _enable_incremental_vacuum(con: sqlite3.Connection):
+    # lets the archiver hand freed pages back in small steps instead of a full VACUUM.
+    # New files get it from Storage.open; an existing one switches with one full VACUUM,
+    # which rewrites the whole file and blocks every write, so it only runs on request.
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    size_mb = (con.execute("PRAGMA page_count").fetchone()[0]
+               * con.execute("PRAGMA page_size").fetchone()[0] / 2 ** 20)
+    if not DB_VACUUM_ON_START:
+        logger.warning(f"{STORAGE.path} ({size_mb:.0f} MB) is not in auto_vacuum=INCREMENTAL mode: archived "
+                       f"orders free pages for reuse, but the file never shrinks. Restart once with "
+                       f"DB_VACUUM_ON_START=1 to switch (runs a full VACUUM, the bot waits for it).")
+        return
+    logger.warning(f"Switching {STORAGE.path} ({size_mb:.0f} MB) to auto_vacuum=INCREMENTAL: "
+                   f"full VACUUM, startup waits for it...")
+    start = time.perf_counter()
+    con.execute("VACUUM")
+    logger.warning(f"VACUUM done in {time.perf_counter() - start:.1f}s")
+
+def _init_schema(con: sqlite3.Connection):
+    _enable_incremental_vacuum(con)
+    _migrate(con)
+    _seed_prices(con)
+
+_catalog_versions = itertools.count(1)  # next() is atomic, safe from the db threads
+
+def _price_rev(con: sqlite3.Connection) -> int:
+    return con.execute("SELECT value FROM meta WHERE key='price_rev'").fetchone()[0]
+
+def _load_catalog(con: sqlite3.Connection) -> PriceCatalog:
+    # rev first: a write landing in between only makes the next refresh reload again
+    rev = _price_rev(con)
+    rows = con.execute("SELECT platform, service, qty, price FROM prices").fetchall()
+    return PriceCatalog(next(_catalog_versions), [tuple(r) for r in rows], rev)
+
+def _swap_catalog(new: PriceCatalog):
+    global CATALOG
+    # writes are serialized, but never let a late callback roll the version back
+    if new.version > CATALOG.version:
+        CATALOG = new
+
+@db_timed
+async def db_init():
+    STORAGE.open()
+    await STORAGE.write(_init_schema)
+    _swap_catalog(await STORAGE.read(_load_catalog))
+
+def db_close():
+    STORAGE.close()
+
+@db_timed
+async def db_refresh_catalog() -> bool:
+    # picks up price changes committed by other processes (sharded mode)
+    if await STORAGE.read(_price_rev) == CATALOG.rev:
+        return False
+    _swap_catalog(await STORAGE.read(_load_catalog))
+    return True
+
+async def _catalog_refresh_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await db_refresh_catalog():
+                logger.info(f"Price catalog reloaded: rev {CATALOG.rev}, v{CATALOG.version}")
+        except Exception as e:
+            logger.warning(f"Catalog refresh failed: {e}")
+
+@db_timed
+async def db_get_lang(user_id: int) -> str:
+    # cache holds the stored lang, or None when the user has no row yet
+    stored = LANG_CACHE.get(user_id)
+    if stored is MISSING:
+        def q(con):
+            row = con.execute("SELECT lang FROM users WHERE user_id=?", (user_id,)).fetchone()
+            return row["lang"] if row else None
+        stored = await STORAGE.read(q)
+        LANG_CACHE.set(user_id, stored)
+    return stored or DEFAULT_LANG
+
+@db_timed
+async def db_upsert_user(user_id: int, lang: str):
+    if LANG_CACHE.get(user_id) == lang:
+        return  # row exists with the same lang, nothing to write
+    def q(con):
+        con.execute("""
+            INSERT INTO users(user_id, lang, created_at)
+            VALUES(?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET lang=excluded.lang
+        """, (user_id, lang, datetime.utcnow().isoformat()))
+    await WRITES.submit(q)
+    LANG_CACHE.set(user_id, lang)
+
+@db_timed
+async def db_get_price(platform: str, service: str, qty: int):
+    # served from the in-memory CATALOG snapshot, no SQL on the hot path; None = not on sale
+    price = CATALOG.price(platform, service, qty)
+    if price is not None or len(CATALOG):
+        return price
+    # fallback only while the prices table is empty: a pack dropped by an import stays dropped
+    price = DEFAULT_PRICES.get(service, {}).get(qty)
+    return int(price) if price is not None else None
+
+def catalog_packs(platform: str, service: str):
+    if len(CATALOG):
+        return list(CATALOG.packs(platform, service))
+    # fallback (empty prices table)
     packs = DEFAULT_PRICES.get(service, {})
     return sorted([(int(q), int(p)) for q, p in packs.items()], key=lambda x: x[0])
 
-def db_create_order(user_id: int, platform: str, service: str, qty: int, price: int, proof_file_id: str, proof_type: str):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("""
-        INSERT INTO orders(user_id, platform, service, qty, price, status, created_at, proof_file_id, proof_type)
-        VALUES(?,?,?,?,?,'pending',?,?,?)
-    """, (user_id, platform, service, qty, price, datetime.utcnow().isoformat(), proof_file_id, proof_type))
-    con.commit()
-    order_id = cur.lastrowid
-    con.close()
-    return int(order_id)
-
-def db_list_orders_by_user(user_id: int):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("""
-        SELECT id, platform, service, qty, price, status, created_at
-        FROM orders WHERE user_id=?
-        ORDER BY id DESC
-        LIMIT 50
-    """, (user_id,))
-    rows = cur.fetchall()
-    con.close()
-    return rows
-
-def db_count_orders_by_user(user_id: int) -> int:
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM orders WHERE user_id=?", (user_id,))
-    n = int(cur.fetchone()["c"])
-    con.close()
-    return n
-
-def db_list_pending_orders(limit: int = 30):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("""
-        SELECT id, user_id, platform, service, qty, price, status, created_at
-        FROM orders WHERE status='pending'
-        ORDER BY id ASC
-        LIMIT ?
-    """, (limit,))
-    rows = cur.fetchall()
-    con.close()
-    return rows
-
-def db_update_order_status(order_id: int, status: str) -> bool:
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("UPDATE orders SET status=? WHERE id=?", (status, order_id))
-    con.commit()
-    ok = cur.rowcount > 0
-    con.close()
-    return ok
-
-def db_set_price(platform: str, service: str, qty: int, price: int):
-    con = db_connect()
-    cur = con.cursor()
-    cur.execute("""
-        INSERT OR REPLACE INTO prices(platform, service, qty, price)
-        VALUES(?,?,?,?)
-    """, (platform, service, qty, price))
-    con.commit()
-    con.close()
+@db_timed
+async def db_create_order(user_id: int, platform: str, service: str, qty: int, price: int,
+                          proof_file_id: str, proof_type: str, source_key: str = None, receipt_key: str = None):
+    """
+    Insert a pending order unless it already exists. Returns
+    {"status": "created" | "replayed" | "duplicate", "order_id", "owner_id"}:
+    replayed  - an order was already made from this source message (redelivered update);
+    duplicate - this receipt file (file_unique_id) was already used by order `order_id` of `owner_id`.
+    Lookups and insert run in one write transaction, so two copies can't both get in.
+    """
+    def q(con):
+        if source_key:
+            row = con.execute("SELECT id, user_id FROM orders WHERE source_key=?", (source_key,)).fetchone()
+            if row:
+                return {"status": "replayed", "order_id": row["id"], "owner_id": row["user_id"]}
+        if receipt_key:
+            row = con.execute("SELECT order_id, user_id FROM receipts WHERE file_unique_id=?",
+                              (receipt_key,)).fetchone()
+            if row:
+                return {"status": "duplicate", "order_id": row["order_id"], "owner_id": row["user_id"]}
+        now = datetime.utcnow().isoformat()
+        cur = con.execute("""
+            INSERT INTO orders(user_id, platform, service, qty, price, status, created_at, proof_file_id, proof_type,
+                               source_key)
+            VALUES(?,?,?,?,?,'pending',?,?,?,?)
+        """, (user_id, platform, service, qty, price, now, proof_file_id, proof_type, source_key))
+        order_id = int(cur.lastrowid)
+        if receipt_key:
+            con.execute("INSERT INTO receipts(file_unique_id, order_id, user_id, created_at) VALUES(?,?,?,?)",
+                        (receipt_key, order_id, user_id, now))
+        return {"status": "created", "order_id": order_id, "owner_id": user_id}
+    return await WRITES.submit(q)
+
+@db_timed
+async def db_find_order_by_source(source_key: str):
+    # id of the order already made from this source message, or None
+    def q(con):
+        row = con.execute("SELECT id FROM orders WHERE source_key=?", (source_key,)).fetchone()
+        return row["id"] if row else None
+    return await STORAGE.read(q)
+
+@db_timed
+async def db_list_orders_by_user(user_id: int, before_id: int = None, after_id: int = None,
+                                 limit: int = ORDERS_PAGE_SIZE):
+    """
+    Keyset page of a user's orders, newest first, across `orders` and `orders_archive`.
+    before_id -> the next older page, after_id -> the next newer page.
+    Returns (rows, more): `more` = rows exist beyond this page in that direction.
+    Each table is seeked on its (user_id, id) index and the two pages are merged,
+    so deep pages cost the same as page 1 and archived orders show up once the
+    user scrolls past the ones still in the hot table.
+    """
+    def page(con, table):
+        if after_id is not None:
+            return con.execute(f"""
+                SELECT id, platform, service, qty, price, status, created_at
+                FROM {table} WHERE user_id=? AND id>?
+                ORDER BY id ASC
+                LIMIT ?
+            """, (user_id, after_id, limit + 1)).fetchall()
+        if before_id is not None:
+            return con.execute(f"""
+                SELECT id, platform, service, qty, price, status, created_at
+                FROM {table} WHERE user_id=? AND id<?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (user_id, before_id, limit + 1)).fetchall()
+        return con.execute(f"""
+            SELECT id, platform, service, qty, price, status, created_at
+            FROM {table} WHERE user_id=?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (user_id, limit + 1)).fetchall()
+
+    def q(con):
+        rows = page(con, "orders") + page(con, "orders_archive")
+        if after_id is not None:
+            rows = sorted(rows, key=lambda r: r["id"])[:limit + 1]
+            return rows[:limit][::-1], len(rows) > limit
+        rows = sorted(rows, key=lambda r: r["id"], reverse=True)[:limit + 1]
+        return rows[:limit], len(rows) > limit
+    return await STORAGE.read(q)
+
+@db_timed
+async def db_count_orders_by_user(user_id: int) -> int:
+    # O(1): trigger-maintained counter instead of COUNT(*) over orders
+    def q(con):
+        row = con.execute("SELECT orders FROM user_order_counts WHERE user_id=?", (user_id,)).fetchone()
+        return int(row["orders"]) if row else 0
+    return await STORAGE.read(q)
+
+@db_timed
+async def db_order_status_counts() -> dict:
+    def q(con):
+        return {r["status"]: int(r["orders"]) for r in con.execute("SELECT status, orders FROM order_status_counts")}
+    return await STORAGE.read(q)
+
+@db_timed
+async def db_rebuild_order_counters() -> dict:
+    return await STORAGE.write(_rebuild_order_counters)
+
+@db_timed
+async def db_list_pending_orders(after_id: int = None, before_id: int = None,
+                                 limit: int = ORDERS_PAGE_SIZE):
+    """
+    Keyset page of pending orders, oldest first (same contract as
+    db_list_orders_by_user): after_id -> next page, before_id -> previous page.
+    """
+    def q(con):
+        if before_id is not None:
+            rows = con.execute("""
+                SELECT id, user_id, platform, service, qty, price, status, created_at
+                FROM orders WHERE status='pending' AND id<?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (before_id, limit + 1)).fetchall()
+            return rows[:limit][::-1], len(rows) > limit
+        rows = con.execute("""
+            SELECT id, user_id, platform, service, qty, price, status, created_at
+            FROM orders WHERE status='pending' AND id>?
+            ORDER BY id ASC
+            LIMIT ?
+        """, (after_id or 0, limit + 1)).fetchall()
+        return rows[:limit], len(rows) > limit
+    return await STORAGE.read(q)
+
+@db_timed
+async def db_bulk_update_order_status(order_ids, status: str) -> dict:
+    """
+    Set `status` on many orders in one transaction (single executemany).
+    Returns {"updated": [ids], "unchanged": [ids], "missing": [ids], "previous": {id: old_status},
+    "orders": {id: {"user_id", "platform", "service", "qty"}}} (`orders` for updated ids only).
+    """
+    ids = sorted(set(order_ids))
+    def q(con):
+        rows = {r["id"]: r for r in con.execute(
+            "SELECT id, user_id, platform, service, qty, status FROM orders "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),),
+        )}
+        current = {i: r["status"] for i, r in rows.items()}
+        updated = [i for i in ids if i in current and current[i] != status]
+        con.executemany("UPDATE orders SET status=? WHERE id=?", [(status, i) for i in updated])
+        return {
+            "updated": updated,
+            "unchanged": [i for i in ids if current.get(i) == status],
+            "missing": [i for i in ids if i not in current],
+            "previous": {i: current[i] for i in updated},
+            "orders": {i: {k: rows[i][k] for k in ("user_id", "platform", "service", "qty")} for i in updated},
+        }
+    return await STORAGE.write(q)
+
+@db_timed
+async def db_restore_order_statuses(previous: dict, expected_status: str) -> list:
+    """
+    Undo for db_bulk_update_order_status: only rows still in `expected_status` are reverted.
+    Returns the reverted orders as dicts (id, user_id, platform, service, qty).
+    """
+    def q(con):
+        rows = [dict(r) for r in con.execute(
+            "SELECT id, user_id, platform, service, qty FROM orders "
+            "WHERE id IN (SELECT value FROM json_each(?)) AND status=?",
+            (json.dumps(list(previous)), expected_status),
+        )]
+        con.executemany("UPDATE orders SET status=? WHERE id=?", [(previous[r["id"]], r["id"]) for r in rows])
+        return rows
+    return await STORAGE.write(q)
+
+@db_timed
+async def db_set_price(platform: str, service: str, qty: int, price: int):
+    def q(con):
+        con.execute("""
+            INSERT OR REPLACE INTO prices(platform, service, qty, price)
+            VALUES(?,?,?,?)
+        """, (platform, service, qty, price))
+        # rebuilt inside the same transaction, so the snapshot matches the commit
+        return _load_catalog(con)
+    _swap_catalog(await STORAGE.write(q))
+
+@db_timed
+async def db_replace_prices(prices: dict, expected_version: int):
+    """
+    Make the prices table equal to `prices` ({(platform, service, qty): price})
+    in one transaction and swap in the new CATALOG. Returns the number of rows
+    written/deleted, or None if the catalog changed since `expected_version`.
+    """
+    def q(con):
+        # another process may have changed prices since our snapshot was loaded
+        if CATALOG.version != expected_version or _price_rev(con) != CATALOG.rev:
+            return None, None
+        current = CATALOG.items()
+        upserts = [(p, s, qty, price) for (p, s, qty), price in prices.items() if current.get((p, s, qty)) != price]
+        deletes = [key for key in current if key not in prices]
+        con.executemany("INSERT OR REPLACE INTO prices(platform, service, qty, price) VALUES(?,?,?,?)", upserts)
+        con.executemany("DELETE FROM prices WHERE platform=? AND service=? AND qty=?", deletes)
+        return len(upserts) + len(deletes), _load_catalog(con)
+    count, catalog = await STORAGE.write(q)
+    if catalog is not None:
+        _swap_catalog(catalog)
+    return count
+
+# ----- archival -----
+
+ORDERS_ARCHIVED = METRICS.counter("bot_orders_archived_total", "Orders moved to orders_archive")
+
+@db_timed
+async def db_archive_orders(cutoff: str, limit: int = ARCHIVE_BATCH) -> int:
+    """
+    Move up to `limit` done/cancel orders that reached that status before `cutoff`
+    (ISO time) to orders_archive in one short write transaction. Returns how many were moved.
+    """
+    def q(con):
+        # idx_orders_status_at: a range seek per status
+        ids = [r[0] for r in con.execute("""
+            SELECT id FROM orders WHERE status IN ('done', 'cancel') AND status_at<?
+            LIMIT ?
+        """, (cutoff, limit))]
+        if not ids:
+            return 0
+        batch = json.dumps(ids)
+        con.execute("""
+            INSERT OR REPLACE INTO orders_archive(id, user_id, platform, service, qty, price, status, created_at,
+                                                  proof_file_id, proof_type, source_key, status_at, archived_at)
+            SELECT id, user_id, platform, service, qty, price, status, created_at,
+                   proof_file_id, proof_type, source_key, status_at, ?
+            FROM orders WHERE id IN (SELECT value FROM json_each(?))
+        """, (datetime.utcnow().isoformat(), batch))
+        # the delete trigger sees the archived copy and leaves the counters alone
+        con.execute("DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?))", (batch,))
+        return len(ids)
+    moved = await STORAGE.write(q)
+    ORDERS_ARCHIVED.inc(amount=moved)
+    return moved
+
+@db_timed
+async def db_incremental_vacuum(pages: int) -> int:
+    """Return up to `pages` free pages to the OS. Returns the free pages left."""
+    def q(con):
+        # executescript steps the pragma to the end; execute() would free a single page
+        con.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return con.execute("PRAGMA freelist_count").fetchone()[0]
+    return await STORAGE.write(q)
+
+async def archive_orders(days: float = ARCHIVE_AFTER_DAYS) -> int:
+    """One archival run: move old terminal orders batch by batch, then shrink the file."""
+    # never inside the undo window: db_restore_order_statuses only sees the hot table
+    age = max(timedelta(days=days), timedelta(seconds=BULK_UNDO_WINDOW))
+    cutoff = (datetime.utcnow() - age).isoformat()
+    moved = 0
+    while True:
+        n = await db_archive_orders(cutoff)
+        moved += n
+        if n < ARCHIVE_BATCH:
+            break
+        await asyncio.sleep(ARCHIVE_PAUSE_MS / 1000)
+    left = None
+    while left != 0:
+        before, left = left, await db_incremental_vacuum(VACUUM_STEP_PAGES)
+        if left == before:
+            break  # not in incremental mode (see DB_VACUUM_ON_START), nothing to give back
+        await asyncio.sleep(ARCHIVE_PAUSE_MS / 1000)
+    return moved
+
+async def _archive_loop(interval: float):
+    while True:
+        try:
+            moved = await archive_orders()
+            if moved:
+                logger.info(f"Archived {moved} orders done/cancelled over {ARCHIVE_AFTER_DAYS:g} days ago")
+        except Exception as e:
+            logger.warning(f"Order archival failed: {e}")
+        await asyncio.sleep(interval)
 
 # ===================== CALLBACK utils =====================
 
@@ -490,7 +1712,32 @@ def cb_pack(service: str, qty: int) -> str:
     # "pack:tiktok_followers:100"
     return f"pack:{service}:{qty}"
 
-def parse_cb(data: str):
+class ParsedCallback:
+    """callback_data split once and converted to the route's argument types."""
+    __slots__ = ("prefix", "args")
+
+    def __init__(self, prefix: str, args: tuple):
+        self.prefix = prefix
+        self.args = args
+
+    def __repr__(self) -> str:
+        return f"ParsedCallback({self.prefix!r}, {self.args!r})"
+
+# prefix -> (handler, arg types); filled by @callback_route
+CALLBACK_ROUTES = {}
+
+def callback_route(prefix: str, *arg_types):
+    """
+    Register `handler(cb, data: ParsedCallback)` for "prefix:arg1:arg2...".
+    arg_types (str/int) define both the arity and the conversion, e.g.
+      @callback_route("pack", str, int)  ->  pack:tiktok_followers:100
+    """
+    def decorator(handler):
+        CALLBACK_ROUTES[prefix] = (handler, arg_types)
+        return handler
+    return decorator
+
+def parse_callback(data: str):
     """
     Supported:
       lang:ru
@@ -498,31 +1745,203 @@ def parse_cb(data: str):
       plat:tiktok
       srv:tiktok_followers
       pack:tiktok_followers:100
-      nav:back:...
       admin:pending/done/cancel/prices
+    Returns None for anything malformed (unknown prefix, wrong arity, bad int).
     """
-    if not data or ":" not in data:
+    if not data:
+        return None
+    prefix, sep, rest = data.partition(":")
+    route = CALLBACK_ROUTES.get(prefix)
+    if route is None or not sep:
         return None
-    parts = data.split(":")
-    return parts
+    arg_types = route[1]
+    parts = rest.split(":")
+    if len(parts) != len(arg_types):
+        return None
+    args = []
+    for raw, typ in zip(parts, arg_types):
+        if not raw:
+            return None
+        if typ is int:
+            if not raw.isdecimal():  # isdigit() lets "²" through to int()
+                return None
+            args.append(int(raw))
+        else:
+            args.append(raw)
+    return ParsedCallback(prefix, tuple(args))
+
+# ===================== Sessions =====================
+
+class UserSession:
+    """Purchase-flow selection of one user."""
+    __slots__ = ("platform", "service", "qty", "price", "awaiting_proof")
+
+    def __init__(self, platform=None, service=None, qty=None, price=None, awaiting_proof=False):
+        self.platform = platform
+        self.service = service
+        self.qty = qty
+        self.price = price
+        self.awaiting_proof = awaiting_proof
+
+    def has_pack(self) -> bool:
+        return bool(self.platform and self.service and self.qty) and self.price is not None
+
+    def dump(self) -> list:
+        return [self.platform, self.service, self.qty, self.price, self.awaiting_proof]
+
+class AdminSession:
+    """Pending admin input: "done" / "cancel" (order ids) or "setprice"."""
+    __slots__ = ("mode",)
+
+    def __init__(self, mode=None):
+        self.mode = mode
+
+    def dump(self) -> list:
+        return [self.mode]
+
+SESSION_KINDS = {"user": UserSession, "admin": AdminSession}
+
+class MemorySessionStore:
+    """
+    Sessions in process memory, one LRUCache per kind: idle sessions expire
+    after `ttl` seconds and the least recently used ones are evicted past
+    `maxsize`. Lost on restart.
+    """
 
-# ===================== In-memory state (fallback) =====================
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self._caches = {kind: LRUCache(maxsize, ttl) for kind in SESSION_KINDS}
 
-# user_id -> dict with selection context
-USER_CTX = {}  # { user_id: { "platform":..., "service":..., "qty":..., "price":... } }
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
 
-# admin state: waiting for order id input (done/cancel) and waiting for setprice
-ADMIN_STATE = {}  # { admin_id: {"mode": "done"/"cancel"/"setprice"} }
+    async def get(self, kind: str, key: int):
+        rec = self._caches[kind].get(key)
+        return None if rec is MISSING else rec
+
+    async def put(self, kind: str, key: int, record):
+        self._caches[kind].set(key, record)
+
+    async def drop(self, kind: str, key: int):
+        self._caches[kind].pop(key)
+
+    def stats(self) -> dict:
+        return {kind: cache.stats() for kind, cache in self._caches.items()}
+
+class SqliteSessionStore(MemorySessionStore):
+    """
+    Memory store backed by the `sessions` table, so half-finished flows
+    survive a restart. Reads hit memory first and load from SQLite on a miss;
+    writes mark the session dirty and a background task flushes all dirty
+    sessions in one transaction every `flush_interval` seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, flush_interval: float):
+        super().__init__(maxsize, ttl)
+        self.flush_interval = flush_interval
+        self._dirty = {}  # (kind, key) -> record, None = delete
+        self._flush_task = None
+        self.flushes = 0
+
+    async def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def get(self, kind: str, key: int):
+        cache = self._caches[kind]
+        rec = cache.get(key)
+        if rec is not MISSING:
+            return rec
+        if (kind, key) in self._dirty:
+            # evicted from memory before it was flushed
+            rec = self._dirty[(kind, key)]
+        else:
+            cutoff = time.time() - self.ttl
+            def q(con):
+                return con.execute("SELECT data FROM sessions WHERE kind=? AND key=? AND updated_at>?",
+                                   (kind, key, cutoff)).fetchone()
+            row = await STORAGE.read(q)
+            rec = SESSION_KINDS[kind](*json.loads(row["data"])) if row else None
+        cache.set(key, rec)  # negative entries too, so unknown users stay off the db
+        return rec
+
+    async def put(self, kind: str, key: int, record):
+        self._caches[kind].set(key, record)
+        self._dirty[(kind, key)] = record
+
+    async def drop(self, kind: str, key: int):
+        self._caches[kind].set(key, None)
+        self._dirty[(kind, key)] = None
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        # serialize here, on the loop, so the writer thread never sees a record mid-update
+        upserts = [(kind, key, json.dumps(rec.dump()), now) for (kind, key), rec in dirty.items() if rec is not None]
+        deletes = [(kind, key) for (kind, key), rec in dirty.items() if rec is None]
+        cutoff = now - self.ttl
+        def q(con):
+            con.executemany("""
+                INSERT INTO sessions(kind, key, data, updated_at) VALUES(?,?,?,?)
+                ON CONFLICT(kind, key) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at
+            """, upserts)
+            con.executemany("DELETE FROM sessions WHERE kind=? AND key=?", deletes)
+            con.execute("DELETE FROM sessions WHERE updated_at<?", (cutoff,))
+        try:
+            await STORAGE.write(q)
+        except Exception:
+            # put them back unless a newer write happened meanwhile
+            for k, rec in dirty.items():
+                self._dirty.setdefault(k, rec)
+            raise
+        self.flushes += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Session flush failed: {e}")
+
+    def stats(self) -> dict:
+        return {**super().stats(), "dirty": len(self._dirty), "flushes": self.flushes}
+
+def make_session_store():
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore(SESSION_MAX, SESSION_TTL)
+    if SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore(SESSION_MAX, SESSION_TTL, SESSION_FLUSH_INTERVAL)
+    raise ValueError(f"SESSION_BACKEND must be 'memory' or 'sqlite', got '{SESSION_BACKEND}'")
+
+SESSIONS = make_session_store()
 
 # ===================== Keyboards =====================
 
-def kb_lang() -> InlineKeyboardMarkup:
+# builders: allocate fresh pydantic models, called only by KeyboardRegistry
+
+def _build_lang() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=I18N["ru"]["lang_name"], callback_data=cb_kv("lang", "ru"))],
-        [InlineKeyboardButton(text=I18N["kz"]["lang_name"], callback_data=cb_kv("lang", "kz"))],
+        [InlineKeyboardButton(text=t(code, "lang_name"), callback_data=cb_kv("lang", code))]
+        for code in I18N
     ])
 
-def kb_home(lang: str) -> InlineKeyboardMarkup:
+def _build_home(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=t(lang, "menu_prices"), callback_data=cb_kv("menu", "prices"))],
         [InlineKeyboardButton(text=t(lang, "menu_orders"), callback_data=cb_kv("menu", "orders"))],
@@ -530,7 +1949,7 @@ def kb_home(lang: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text=t(lang, "menu_lang"), callback_data=cb_kv("menu", "lang"))],
     ])
 
-def kb_back_home(lang: str, back_cb: str) -> InlineKeyboardMarkup:
+def _build_back_home(lang: str, back_cb: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(text=t(lang, "back"), callback_data=back_cb),
@@ -538,7 +1957,7 @@ def kb_back_home(lang: str, back_cb: str) -> InlineKeyboardMarkup:
         ]
     ])
 
-def kb_platforms(lang: str) -> InlineKeyboardMarkup:
+def _build_platforms(lang: str) -> InlineKeyboardMarkup:
     rows = [
         [InlineKeyboardButton(text=t(lang, "tiktok"), callback_data=cb_kv("plat", "tiktok"))],
         [InlineKeyboardButton(text=t(lang, "instagram"), callback_data=cb_kv("plat", "instagram"))],
@@ -551,7 +1970,7 @@ def kb_platforms(lang: str) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def kb_services(lang: str, platform: str) -> InlineKeyboardMarkup:
+def _build_services(lang: str, platform: str) -> InlineKeyboardMarkup:
     srv_map = SERVICES.get(platform, {})
     rows = []
     for srv_key, meta in srv_map.items():
@@ -562,8 +1981,7 @@ def kb_services(lang: str, platform: str) -> InlineKeyboardMarkup:
     ])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def kb_packs(lang: str, platform: str, service: str) -> InlineKeyboardMarkup:
-    packs = db_list_packs(platform, service)
+def _build_packs(lang: str, platform: str, service: str, packs) -> InlineKeyboardMarkup:
     rows = []
     for qty, price in packs:
         txt = f"{qty} — {price}₸"
@@ -574,7 +1992,7 @@ def kb_packs(lang: str, platform: str, service: str) -> InlineKeyboardMarkup:
     ])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def kb_final(lang: str) -> InlineKeyboardMarkup:
+def _build_final(lang: str) -> InlineKeyboardMarkup:
     # admin url without @
     admin_user_clean = ADMIN_USERNAME.lstrip("@")
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -585,15 +2003,106 @@ def kb_final(lang: str) -> InlineKeyboardMarkup:
         ],
     ])
 
-def kb_admin(lang: str) -> InlineKeyboardMarkup:
+def _build_admin(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=t(lang, "admin_btn_pending"), callback_data="admin:pending")],
         [InlineKeyboardButton(text=t(lang, "admin_btn_done"), callback_data="admin:done")],
         [InlineKeyboardButton(text=t(lang, "admin_btn_cancel"), callback_data="admin:cancel")],
         [InlineKeyboardButton(text=t(lang, "admin_btn_prices"), callback_data="admin:prices")],
+        [InlineKeyboardButton(text=t(lang, "admin_btn_import"), callback_data="admin:import")],
+        [InlineKeyboardButton(text=t(lang, "admin_btn_stats"), callback_data="admin:stats")],
         [InlineKeyboardButton(text=t(lang, "home"), callback_data=cb_kv("menu", "home"))],
     ])
 
+class KeyboardRegistry:
+    """
+    Prebuilt InlineKeyboardMarkup objects.
+    Static keyboards are built once per language in I18N by build(); pack
+    keyboards are cached per (lang, platform, service) and dropped whenever
+    the CATALOG version changes. The markups are shared, never mutate them.
+    """
+
+    def __init__(self):
+        self._static = {}  # (name, lang, *args) -> markup
+        self._packs = {}   # (lang, platform, service) -> markup
+        self._packs_version = None
+
+    def build(self):
+        static = {("lang",): _build_lang()}
+        for lang in I18N:
+            static[("home", lang)] = _build_home(lang)
+            static[("back_home", lang, cb_kv("menu", "prices"))] = _build_back_home(lang, cb_kv("menu", "prices"))
+            static[("platforms", lang)] = _build_platforms(lang)
+            static[("final", lang)] = _build_final(lang)
+            static[("admin", lang)] = _build_admin(lang)
+            for platform in PLATFORMS:
+                static[("services", lang, platform)] = _build_services(lang, platform)
+        self._static = static
+        self._packs = {}
+        self._packs_version = CATALOG.version
+        for lang in I18N:
+            for platform, srv_map in SERVICES.items():
+                for service in srv_map:
+                    self.packs(lang, platform, service)
+        logger.info(f"Keyboards built: static={len(self._static)} packs={len(self._packs)}")
+
+    def get(self, key: tuple, builder, *args) -> InlineKeyboardMarkup:
+        kb = self._static.get(key)
+        if kb is None:
+            # not prebuilt (unknown lang / build() not run yet) -> build uncached
+            kb = builder(*args)
+        return kb
+
+    def packs(self, lang: str, platform: str, service: str) -> InlineKeyboardMarkup:
+        if self._packs_version != CATALOG.version:
+            self._packs = {}
+            self._packs_version = CATALOG.version
+        key = (lang, platform, service)
+        kb = self._packs.get(key)
+        if kb is None:
+            kb = _build_packs(lang, platform, service, catalog_packs(platform, service))
+            if service in SERVICES.get(platform, {}):
+                self._packs[key] = kb
+        return kb
+
+KEYBOARDS = KeyboardRegistry()
+
+def kb_lang() -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("lang",), _build_lang)
+
+def kb_home(lang: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("home", lang), _build_home, lang)
+
+def kb_back_home(lang: str, back_cb: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("back_home", lang, back_cb), _build_back_home, lang, back_cb)
+
+def kb_platforms(lang: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("platforms", lang), _build_platforms, lang)
+
+def kb_services(lang: str, platform: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("services", lang, platform), _build_services, lang, platform)
+
+def kb_packs(lang: str, platform: str, service: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.packs(lang, platform, service)
+
+def kb_final(lang: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("final", lang), _build_final, lang)
+
+def kb_admin(lang: str) -> InlineKeyboardMarkup:
+    return KEYBOARDS.get(("admin", lang), _build_admin, lang)
+
+def kb_page(base: InlineKeyboardMarkup, lang: str, prefix: str,
+            prev_cursor: int = None, next_cursor: int = None) -> InlineKeyboardMarkup:
+    # shared `base` rows + a ◀️/▶️ row whose callbacks carry the keyset cursor: "<prefix>:p|n:<id>"
+    nav = []
+    if prev_cursor is not None:
+        nav.append(InlineKeyboardButton(text=t(lang, "page_prev"), callback_data=f"{prefix}:p:{prev_cursor}"))
+    if next_cursor is not None:
+        nav.append(InlineKeyboardButton(text=t(lang, "page_next"), callback_data=f"{prefix}:n:{next_cursor}"))
+    if not nav:
+        return base
+    return InlineKeyboardMarkup(inline_keyboard=[nav, *base.inline_keyboard])
+
 # ===================== Render helpers =====================
 
 def platform_title(lang: str, platform: str) -> str:
@@ -611,6 +2120,112 @@ def service_title(lang: str, platform: str, service: str) -> str:
             return t(lang, m[service]["title_key"])
     return service
 
+def parse_id_list(text: str, limit: int):
+    """
+    "12, 15 20-80" -> [12, 15, 20, 21, ..., 80] (sorted, unique).
+    None if anything is malformed or more than `limit` ids are requested.
+    """
+    ids = set()
+    for token in re.split(r"[,\s]+", text.strip()):
+        if not token:
+            continue
+        m = re.fullmatch(r"(\d+)(?:-(\d+))?", token)
+        if not m:
+            return None
+        lo = int(m.group(1))
+        hi = int(m.group(2)) if m.group(2) else lo
+        if hi < lo or hi - lo + 1 + len(ids) > limit:
+            return None
+        ids.update(range(lo, hi + 1))
+    return sorted(ids) or None
+
+def format_id_ranges(ids, max_len: int = 600) -> str:
+    # [1, 2, 3, 7, 9, 10] -> "#1-3, #7, #9-10"
+    parts = []
+    ids = sorted(ids)
+    i = 0
+    while i < len(ids):
+        j = i
+        while j + 1 < len(ids) and ids[j + 1] == ids[j] + 1:
+            j += 1
+        parts.append(f"#{ids[i]}" if i == j else f"#{ids[i]}-{ids[j]}")
+        i = j + 1
+    text = ", ".join(parts)
+    return text if len(text) <= max_len else text[:max_len].rsplit(", ", 1)[0] + ", …"
+
+PRICE_FIELDS = ("platform", "service", "qty", "price")
+
+def export_prices(catalog: PriceCatalog, fmt: str = "csv") -> bytes:
+    rows = [(p, s, qty, price) for (p, s, qty), price in sorted(catalog.items().items())]
+    if fmt == "json":
+        return json.dumps([dict(zip(PRICE_FIELDS, r)) for r in rows], ensure_ascii=False, indent=1).encode()
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(PRICE_FIELDS)
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+def parse_price_file(filename: str, data: bytes):
+    """
+    CSV (header platform,service,qty,price) or JSON (list of such objects)
+    -> ({(platform, service, qty): price}, [errors]). Every row is validated
+    against PLATFORMS/SERVICES; any error rejects the whole file.
+    """
+    errors = []
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return {}, ["file is not UTF-8"]
+    if filename.lower().endswith(".json") or text.lstrip().startswith("["):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            return {}, [f"bad JSON: {e}"]
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            return {}, ["JSON must be a list of objects"]
+        first_line = 1
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or set(PRICE_FIELDS) - set(reader.fieldnames):
+            return {}, [f"CSV header must contain: {','.join(PRICE_FIELDS)}"]
+        records = list(reader)
+        first_line = 2
+
+    prices = {}
+    for n, rec in enumerate(records, start=first_line):
+        platform = str(rec.get("platform") or "").strip().lower()
+        service = str(rec.get("service") or "").strip()
+        qty_s = str(rec.get("qty") if rec.get("qty") is not None else "").strip()
+        price_s = str(rec.get("price") if rec.get("price") is not None else "").strip()
+        if platform not in PLATFORMS:
+            errors.append(f"row {n}: unknown platform '{platform}'")
+            continue
+        if service not in SERVICES.get(platform, {}):
+            errors.append(f"row {n}: unknown service '{service}' for {platform}")
+            continue
+        if not qty_s.isdecimal() or int(qty_s) <= 0:
+            errors.append(f"row {n}: qty must be a positive integer, got '{qty_s}'")
+            continue
+        if not price_s.isdecimal():
+            errors.append(f"row {n}: price must be a non-negative integer, got '{price_s}'")
+            continue
+        key = (platform, service, int(qty_s))
+        if key in prices:
+            errors.append(f"row {n}: duplicate {platform}/{service}/{qty_s}")
+            continue
+        prices[key] = int(price_s)
+    if not prices and not errors:
+        errors.append("file has no rows")
+    return prices, errors
+
+def diff_prices(catalog: PriceCatalog, prices: dict):
+    # -> (added [(key, new)], changed [(key, old, new)], removed [(key, old)])
+    current = catalog.items()
+    added = [(k, v) for k, v in sorted(prices.items()) if k not in current]
+    changed = [(k, current[k], v) for k, v in sorted(prices.items()) if k in current and current[k] != v]
+    removed = [(k, v) for k, v in sorted(current.items()) if k not in prices]
+    return added, changed, removed
+
 # ===================== BOT init =====================
 
 async def safe_answer(cb: CallbackQuery, text: str):
@@ -634,6 +2249,528 @@ async def send_welcome(message: Message, lang: str):
     txt = f"{t(lang,'welcome_title')}\n\n{t(lang,'welcome_body')}"
     await message.answer(txt, reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
 
+# ===================== Outbound rate limiting =====================
+
+# priority lanes for outgoing API calls, lower value goes first
+PRIORITY_INTERACTIVE = 0  # replies to the user who is waiting right now
+PRIORITY_NOTIFY = 1       # admin notifications
+PRIORITY_BULK = 2         # broadcasts and other mass sends
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NOTIFY: "notify", PRIORITY_BULK: "bulk"}
+
+# lane for API calls made from the current task; set it at the top of a background job
+SEND_PRIORITY = contextvars.ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: reserve() always takes a token and returns
+    how long the caller must wait for it (tokens may go negative).
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, now: float, seconds: float):
+        # flood wait: nothing goes out for `seconds`
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+OUTBOUND_WAIT = METRICS.histogram("bot_outbound_wait_seconds",
+                                  "Time an API call waited for per-chat and global tokens", ("lane",))
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Bot session middleware for every outgoing API call.
+    Messages sent to a chat (send*/copy/forward) wait for a per-chat token;
+    every call that targets a chat then queues by priority lane for a global
+    token. Edits are not held to the per-chat rate, so menu navigation never
+    waits on it; calls without a chat_id (callback answers, getMe) take no
+    tokens at all. TelegramRetryAfter blocks that chat's send bucket, or pauses
+    only the call that got it, and the call is retried.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = LRUCache(maxsize=50000, ttl=3600)
+        self._heap = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        self._pump_task = None
+        self.waits = deque(maxlen=2000)  # recent queue wait times, seconds
+        self.counters = {"sent": 0, "queued": 0, "retries": 0, "flood_waits": 0, "failed": 0}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id, None)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def _pump(self):
+        # hands out global tokens to waiters, best lane first
+        while self._heap:
+            now = time.monotonic()
+            tokens = self._global.available(now)
+            if tokens < 1:
+                await asyncio.sleep((1 - tokens) / self.global_rate)
+                continue
+            _, _, fut = heapq.heappop(self._heap)
+            if fut.done():  # caller was cancelled
+                continue
+            self._global.reserve(now)
+            fut.set_result(None)
+        self._pump_task = None
+
+    @staticmethod
+    def _posts_message(method) -> bool:
+        # Telegram's ~1 msg/s per chat limit is about new messages, not edits
+        name = type(method).__name__
+        return name.startswith("Send") or name in ("CopyMessage", "CopyMessages", "ForwardMessage", "ForwardMessages")
+
+    async def acquire(self, chat_id, priority: int, per_chat: bool = True):
+        start = time.monotonic()
+        delay = self._chat_bucket(chat_id).reserve(start) if per_chat else 0.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not self._heap and self._global.available(time.monotonic()) >= 1:
+            self._global.reserve(time.monotonic())
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._seq), fut))
+            self.counters["queued"] += 1
+            if self._pump_task is None:
+                self._pump_task = asyncio.create_task(self._pump())
+            await fut
+        waited = time.monotonic() - start
+        self.waits.append(waited)
+        OUTBOUND_WAIT.observe(waited, PRIORITY_NAMES.get(priority, str(priority)))
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        per_chat = chat_id is not None and self._posts_message(method)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                start = time.perf_counter()
+                await self.acquire(chat_id, SEND_PRIORITY.get(), per_chat)
+                waited = time.perf_counter() - start
+                if waited > 0.001:
+                    log_span("wait", type(method).__name__, start, waited, chat_id=chat_id)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.counters["flood_waits"] += 1
+                if per_chat:
+                    # later sends to this chat wait too; the retry waits on the bucket
+                    self._chat_bucket(chat_id).block(time.monotonic(), e.retry_after)
+                if attempt >= self.max_retries:
+                    self.counters["failed"] += 1
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                logger.warning(f"Flood wait {e.retry_after}s on {type(method).__name__} "
+                               f"chat={chat_id}, retry {attempt}/{self.max_retries}")
+                if not per_chat:
+                    # edits and chatless calls (callback answers): only this call waits
+                    await asyncio.sleep(e.retry_after)
+                continue
+            self.counters["sent"] += 1
+            return result
+
+    def stats(self) -> dict:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, fut in self._heap:
+            if not fut.done():
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        waits = sorted(self.waits)
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 4) if waits else 0.0
+        return {
+            **self.counters,
+            "queue_depth": depth,
+            "wait_p50": pct(0.50),
+            "wait_p95": pct(0.95),
+            "wait_max": round(waits[-1], 4) if waits else 0.0,
+            "tracked_chats": len(self._chats),
+        }
+
+OUTBOUND = OutboundLimiter(
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES,
+)
+
+# ===================== Render diffing =====================
+
+# what a text message looks like to the user; the same set on sendMessage and editMessageText
+RENDER_FIELDS = ("text", "parse_mode", "entities", "link_preview_options", "disable_web_page_preview", "reply_markup")
+
+class RenderCache(BaseRequestMiddleware):
+    """
+    Session middleware: remembers a fingerprint of what every (chat_id, message_id)
+    shows, taken from our own sendMessage / editMessageText calls. An edit that
+    would render the same text and keyboard again is answered locally with True
+    instead of a round-trip Telegram rejects with "message is not modified".
+    Any other call on the message (caption/markup edits, delete) forgets it.
+    Registered before OUTBOUND, so skipped edits take no rate-limit tokens.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._last = LRUCache(maxsize, ttl)  # (chat_id, message_id) -> fingerprint
+        self._inflight = {}  # (chat_id, message_id) -> [edits in flight, no overlap seen]
+        self.counters = {"edited": 0, "skipped": 0, "not_modified": 0}
+
+    @staticmethod
+    def _fingerprint(method, bot) -> int:
+        defaults = getattr(bot, "default", None)
+
+        def resolved(field):
+            value = getattr(method, field, None)
+            if isinstance(value, Default):
+                # sendMessage carries Default(...) where editMessageText has None: compare what the bot sends
+                value = getattr(defaults, value.name, None)
+            if isinstance(value, Enum):
+                value = value.value  # ParseMode.HTML and a "HTML" default are the same render
+            return repr(value)
+        return hash(tuple(resolved(field) for field in RENDER_FIELDS))
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            if isinstance(result, Message) and (method.reply_markup is None
+                                                or isinstance(method.reply_markup, InlineKeyboardMarkup)):
+                self._last.set((result.chat.id, result.message_id), self._fingerprint(method, bot))
+            return result
+        chat_id, message_id = getattr(method, "chat_id", None), getattr(method, "message_id", None)
+        if chat_id is None or message_id is None:
+            return await make_request(bot, method)
+        key = (chat_id, message_id)
+        if not isinstance(method, EditMessageText):
+            self._last.pop(key)
+            return await make_request(bot, method)
+
+        fingerprint = self._fingerprint(method, bot)
+        if self._last.get(key) == fingerprint:
+            self.counters["skipped"] += 1
+            return True
+        slot = self._inflight.get(key)
+        if slot is None:
+            slot = self._inflight[key] = [0, True]
+        else:
+            slot[1] = False  # two edits racing: which one lands last is unknown
+        slot[0] += 1
+        ok = False
+        try:
+            try:
+                result = await make_request(bot, method)
+                self.counters["edited"] += 1
+            except TelegramBadRequest as e:
+                # already shows exactly this, e.g. the cache was empty after a restart
+                if "message is not modified" not in str(e):
+                    raise
+                self.counters["not_modified"] += 1
+                result = True
+            ok = True
+            return result
+        finally:
+            slot[0] -= 1
+            if ok and slot[1]:
+                self._last.set(key, fingerprint)
+            else:
+                self._last.pop(key)
+            if slot[0] == 0:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {**self.counters, "tracked_messages": len(self._last)}
+
+RENDERS = RenderCache(RENDER_CACHE_SIZE, RENDER_CACHE_TTL)
+
+# ===================== Admin notifications =====================
+
+_BACKGROUND_TASKS = set()
+
+def spawn(coro) -> asyncio.Task:
+    # keep a strong reference until the task is done
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+class AdminDelivery:
+    """Outcome of one receipt notification to one admin."""
+    __slots__ = ("order_id", "admin_id", "ok", "elapsed", "error", "at")
+
+    def __init__(self, order_id: int, admin_id: int, ok: bool, elapsed: float, error: str = None):
+        self.order_id = order_id
+        self.admin_id = admin_id
+        self.ok = ok
+        self.elapsed = elapsed
+        self.error = error
+        self.at = time.time()
+
+# most recent deliveries, newest last
+ADMIN_DELIVERIES = deque(maxlen=500)
+ADMIN_NOTIFY_STATS = {"sent": 0, "failed": 0}
+
+# global cap on concurrent admin sends, shared by every fan-out
+_ADMIN_NOTIFY_SEM = asyncio.Semaphore(ADMIN_NOTIFY_CONCURRENCY)
+
+async def _notify_admin(bot: Bot, message: Message, admin_id: int, order_id: int,
+                        proof_type: str, proof_file_id: str, caption: str) -> AdminDelivery:
+    async with _ADMIN_NOTIFY_SEM:
+        start = time.perf_counter()
+        try:
+            if proof_type == "photo" and message.photo:
+                await bot.send_photo(admin_id, proof_file_id, caption=caption, parse_mode=ParseMode.HTML)
+            elif proof_type == "document" and message.document:
+                await bot.send_document(admin_id, proof_file_id, caption=caption, parse_mode=ParseMode.HTML)
+            else:
+                # fallback forward original message
+                await message.forward(admin_id)
+                await bot.send_message(admin_id, caption, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            return AdminDelivery(order_id, admin_id, False, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+        return AdminDelivery(order_id, admin_id, True, time.perf_counter() - start)
+
+async def notify_admins(bot: Bot, message: Message, order_id: int,
+                        proof_type: str, proof_file_id: str, caption: str):
+    SEND_PRIORITY.set(PRIORITY_NOTIFY)  # behind interactive replies in the send queue
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        _notify_admin(bot, message, admin_id, order_id, proof_type, proof_file_id, caption)
+        for admin_id in ADMIN_IDS
+    ))
+    failed = 0
+    for r in results:
+        ADMIN_DELIVERIES.append(r)
+        if r.ok:
+            ADMIN_NOTIFY_STATS["sent"] += 1
+        else:
+            failed += 1
+            ADMIN_NOTIFY_STATS["failed"] += 1
+            logger.warning(f"Failed to notify admin {r.admin_id} about order #{order_id}: {r.error}")
+    logger.info(f"Order #{order_id}: notified {len(results) - failed}/{len(results)} admins "
+                f"in {time.perf_counter() - start:.3f}s")
+    return results
+
+# ===================== Order events =====================
+
+ORDER_CREATED = "order_created"
+ORDER_STATUS_CHANGED = "order_status_changed"
+RECEIPT_DUPLICATE = "receipt_duplicate"
+PRICE_CHANGED = "price_changed"
+
+class OrderEvent:
+    __slots__ = ("kind", "data", "at", "trace")
+
+    def __init__(self, kind: str, data: dict):
+        self.kind = kind
+        self.data = data
+        self.at = time.monotonic()
+        self.trace = UPDATE_TRACE.get()  # the publishing update; subscriber tasks don't inherit it
+
+class Subscriber:
+    """
+    One consumer of the EventBus: a bounded queue and `workers` tasks calling
+    `handler(events)` with up to `batch` events, gathered for at most `window` seconds.
+    """
+
+    def __init__(self, name: str, handler, maxsize: int, batch: int = 1, window: float = 0.0, workers: int = 1):
+        self.name = name
+        self.handler = handler
+        self.maxsize = max(1, maxsize)
+        self.batch = max(1, batch)
+        self.window = max(0.0, window)
+        self.workers = max(1, workers)
+        self._queue = None
+        self._tasks = []
+        self.counters = {"handled": 0, "failed": 0, "dropped": 0}
+
+    def start(self):
+        if not self._tasks:
+            self._queue = asyncio.Queue(self.maxsize)
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def close(self):
+        # one sentinel per worker, behind everything already queued
+        tasks, self._tasks = self._tasks, []
+        for _ in tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*tasks)
+
+    def offer(self, event: OrderEvent):
+        if not self._tasks:
+            # no worker tasks (before start, after close): deliver in a background task
+            spawn(self._deliver([event]))
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            logger.warning(f"Event queue of {self.name} is full, dropped {event.kind}")
+
+    async def _deliver(self, events):
+        EVENT_LAG.observe(time.monotonic() - events[0].at, self.name)
+        # logs and api/db spans of the handler go under the (first) publishing update's trace id
+        token = UPDATE_TRACE.set(events[0].trace)
+        try:
+            await self.handler(events)
+            self.counters["handled"] += len(events)
+        except Exception as e:
+            self.counters["failed"] += len(events)
+            logger.warning(f"Subscriber {self.name} failed on {len(events)} event(s): {type(e).__name__}: {e}")
+        finally:
+            UPDATE_TRACE.reset(token)
+
+    async def _run(self):
+        # each worker stops at its own sentinel
+        async for events in drain_batches(self._queue, self.batch, self.window):
+            await self._deliver(events)
+
+    def stats(self) -> dict:
+        return {**self.counters, "queued": self._queue.qsize() if self._queue else 0}
+
+class EventBus:
+    """
+    In-process pub/sub for order lifecycle events. publish() only enqueues, so
+    a handler costs the same however many side effects hang off an event; each
+    subscriber drains its own bounded queue and a slow one never blocks the rest.
+    """
+
+    def __init__(self, queue_max: int):
+        self.queue_max = queue_max
+        self._routes = defaultdict(list)  # kind -> [Subscriber]
+        self.subscribers = []
+
+    def subscriber(self, *kinds, batch: int = 1, window: float = 0.0, workers: int = 1):
+        def decorator(fn):
+            sub = Subscriber(fn.__name__, fn, self.queue_max, batch, window, workers)
+            self.subscribers.append(sub)
+            for kind in kinds:
+                self._routes[kind].append(sub)
+            return fn
+        return decorator
+
+    def publish(self, kind: str, **data):
+        EVENTS_PUBLISHED.inc(kind)
+        event = OrderEvent(kind, data)
+        for sub in self._routes.get(kind, ()):
+            sub.offer(event)
+
+    async def start(self):
+        for sub in self.subscribers:
+            sub.start()
+
+    async def close(self):
+        # drain: everything published so far is still handled
+        for sub in self.subscribers:
+            await sub.close()
+
+    def stats(self) -> dict:
+        return {sub.name: sub.stats() for sub in self.subscribers}
+
+EVENTS = EventBus(EVENT_QUEUE_MAX)
+EVENTS_PUBLISHED = METRICS.counter("bot_events_published_total", "Order lifecycle events published", ("event",))
+EVENT_LAG = METRICS.histogram("bot_event_lag_seconds", "Publish to subscriber pickup", ("subscriber",))
+ORDERS_CREATED = METRICS.counter("bot_orders_created_total", "Orders created", ("platform", "service"))
+ORDERS_AMOUNT = METRICS.counter("bot_orders_created_amount_total", "Sum of created order prices, tenge", ("platform",))
+ORDER_STATUS_CHANGES = METRICS.counter("bot_order_status_changes_total", "Order status changes", ("status",))
+RECEIPTS_REJECTED = METRICS.counter("bot_receipts_duplicate_total", "Receipts refused as already used")
+PRICE_CHANGES = METRICS.counter("bot_price_changes_total", "Price rows written by admins")
+CUSTOMER_NOTIFY_STATS = {"sent": 0, "failed": 0}
+
+def _admin_caption(event: OrderEvent) -> str:
+    d = event.data
+    if event.kind == RECEIPT_DUPLICATE:
+        return (
+            f"⚠️ <b>Повторный чек</b>\n"
+            f"👤 User: <code>{d['user_id']}</code> ({html.escape(platform_title('ru', d['platform']))} / "
+            f"{html.escape(service_title('ru', d['platform'], d['service']))} / {d['qty']}, {d['price']}₸)\n"
+            f"🔁 Уже использован в Order <b>#{d['order_id']}</b> (user <code>{d['owner_id']}</code>)\n"
+            f"Новый заказ не создан."
+        )
+    return (
+        f"🧾 <b>Новый чек/скрин</b>\n"
+        f"🆔 Order: <b>#{d['order_id']}</b>\n"
+        f"👤 User: <code>{d['user_id']}</code>\n"
+        f"📌 {platform_title('ru', d['platform'])} / {service_title('ru', d['platform'], d['service'])} / {d['qty']}\n"
+        f"💰 {d['price']}₸\n"
+        f"Статус: <b>pending</b>"
+    )
+
+@EVENTS.subscriber(ORDER_CREATED, RECEIPT_DUPLICATE, workers=ADMIN_NOTIFY_CONCURRENCY)
+async def admin_notifier(events):
+    for event in events:
+        d = event.data
+        await notify_admins(d["bot"], d["message"], d["order_id"], d["proof_type"], d["proof_file_id"],
+                            _admin_caption(event))
+
+@EVENTS.subscriber(ORDER_STATUS_CHANGED, batch=BULK_MAX_IDS, window=NOTIFY_BATCH_WINDOW_MS / 1000)
+async def customer_notifier(events):
+    """One message per customer per batch; an order changed and changed back inside the window is left out."""
+    SEND_PRIORITY.set(PRIORITY_NOTIFY)
+    net = {}  # order_id -> (latest event data, status before the batch)
+    for event in events:
+        d = event.data
+        net[d["order_id"]] = (d, net[d["order_id"]][1] if d["order_id"] in net else d["old"])
+    by_user = defaultdict(list)
+    for order_id, (d, old) in sorted(net.items()):
+        if d["new"] != old:
+            by_user[d["user_id"]].append(d)
+
+    async def send(user_id: int, changes):
+        lang = await db_get_lang(user_id)
+        lines = [t(lang, "order_status_changed")]
+        for d in changes[:ORDERS_PAGE_SIZE]:
+            lines.append(t(lang, "order_row", id=d["order_id"], platform=platform_title(lang, d["platform"]),
+                           service=service_title(lang, d["platform"], d["service"]), qty=d["qty"], status=d["new"]))
+        if len(changes) > ORDERS_PAGE_SIZE:
+            lines.append(t(lang, "order_status_more", count=len(changes) - ORDERS_PAGE_SIZE))
+        try:
+            await changes[-1]["bot"].send_message(user_id, "\n".join(lines), parse_mode=ParseMode.HTML)
+            CUSTOMER_NOTIFY_STATS["sent"] += 1
+        except Exception as e:
+            # blocked the bot, deleted account...: nothing to retry
+            CUSTOMER_NOTIFY_STATS["failed"] += 1
+            logger.warning(f"Failed to notify user {user_id} about {len(changes)} order(s): {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(send(user_id, changes) for user_id, changes in by_user.items()))
+
+@EVENTS.subscriber(ORDER_CREATED, ORDER_STATUS_CHANGED, RECEIPT_DUPLICATE, PRICE_CHANGED, batch=500)
+async def metrics_updater(events):
+    for event in events:
+        d = event.data
+        if event.kind == ORDER_CREATED:
+            ORDERS_CREATED.inc(d["platform"], d["service"])
+            ORDERS_AMOUNT.inc(d["platform"], amount=d["price"])
+        elif event.kind == ORDER_STATUS_CHANGED:
+            ORDER_STATUS_CHANGES.inc(d["new"])
+        elif event.kind == RECEIPT_DUPLICATE:
+            RECEIPTS_REJECTED.inc()
+        elif event.kind == PRICE_CHANGED:
+            PRICE_CHANGES.inc(amount=d["rows"])
+
 # ===================== Dispatcher handlers =====================
 
 dp = Dispatcher()
@@ -646,41 +2783,30 @@ async def cmd_start(message: Message):
 
     # ensure user exists
     user_id = message.from_user.id
-    lang = db_get_lang(user_id)
-    if lang not in ("ru", "kz"):
-        lang = "ru"
-    db_upsert_user(user_id, lang)
+    lang = await db_get_lang(user_id)
+    if lang not in I18N:
+        lang = DEFAULT_LANG
+    await db_upsert_user(user_id, lang)
 
     # show language selection always on /start
     await message.answer(t(lang, "choose_lang_title"), reply_markup=kb_lang(), parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("lang:"))
-async def on_lang(cb: CallbackQuery):
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 2:
-        # fallback
-        lang = db_get_lang(cb.from_user.id)
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-        return
-    _, lang = parts
-    if lang not in ("ru", "kz"):
-        lang = "ru"
+@callback_route("lang", str)
+async def on_lang(cb: CallbackQuery, data: ParsedCallback):
+    lang, = data.args
+    if lang not in I18N:
+        lang = DEFAULT_LANG
 
-    db_upsert_user(cb.from_user.id, lang)
-    USER_CTX.pop(cb.from_user.id, None)  # reset selection
+    await db_upsert_user(cb.from_user.id, lang)
+    await SESSIONS.drop("user", cb.from_user.id)  # reset selection
     await safe_answer(cb, "OK")
     await cb.message.edit_text(t(lang, "welcome_title") + "\n\n" + t(lang, "welcome_body"),
                                reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("menu:"))
-async def on_menu(cb: CallbackQuery):
-    lang = db_get_lang(cb.from_user.id)
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 2:
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-        return
-
-    _, action = parts
+@callback_route("menu", str)
+async def on_menu(cb: CallbackQuery, data: ParsedCallback):
+    lang = await db_get_lang(cb.from_user.id)
+    action, = data.args
     await safe_answer(cb, "✅")
 
     if action in ("home",):
@@ -692,19 +2818,7 @@ async def on_menu(cb: CallbackQuery):
         return
 
     if action == "orders":
-        rows = db_list_orders_by_user(cb.from_user.id)
-        if not rows:
-            await cb.message.edit_text(t(lang, "my_orders_empty"),
-                                       reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-            return
-        lines = [t(lang, "my_orders_title")]
-        for r in rows:
-            plat_t = platform_title(lang, r["platform"])
-            srv_t = service_title(lang, r["platform"], r["service"])
-            lines.append(t(lang, "order_row",
-                           id=r["id"], platform=plat_t, service=srv_t, qty=r["qty"], status=r["status"]))
-        await cb.message.edit_text("\n".join(lines),
-                                   reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+        await show_my_orders(cb, lang)
         return
 
     if action == "faq":
@@ -713,7 +2827,7 @@ async def on_menu(cb: CallbackQuery):
         return
 
     if action == "profile":
-        count = db_count_orders_by_user(cb.from_user.id)
+        count = await db_count_orders_by_user(cb.from_user.id)
         await cb.message.edit_text(
             t(lang, "profile_text",
               user_id=cb.from_user.id,
@@ -731,15 +2845,15 @@ async def on_menu(cb: CallbackQuery):
 
     if action == "sendcheck":
         # user must have selected a package
-        ctx = USER_CTX.get(cb.from_user.id)
-        if not ctx or not all(k in ctx for k in ("platform", "service", "qty", "price")):
+        sess = await SESSIONS.get("user", cb.from_user.id)
+        if not sess or not sess.has_pack():
             await cb.message.edit_text(t(lang, "need_check_first"),
                                        reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
             return
 
         # mark mode "awaiting_proof"
-        ctx["awaiting_proof"] = True
-        USER_CTX[cb.from_user.id] = ctx
+        sess.awaiting_proof = True
+        await SESSIONS.put("user", cb.from_user.id, sess)
         await cb.message.edit_text(t(lang, "send_check_hint"),
                                    reply_markup=kb_back_home(lang, cb_kv("menu", "prices")),
                                    parse_mode=ParseMode.HTML)
@@ -749,92 +2863,66 @@ async def on_menu(cb: CallbackQuery):
     await cb.message.edit_text(t(lang, "unknown_callback"),
                                reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("plat:"))
-async def on_platform(cb: CallbackQuery):
-    lang = db_get_lang(cb.from_user.id)
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 2:
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-        return
-
-    _, platform = parts
+@callback_route("plat", str)
+async def on_platform(cb: CallbackQuery, data: ParsedCallback):
+    lang = await db_get_lang(cb.from_user.id)
+    platform, = data.args
     if platform not in PLATFORMS:
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    # save ctx
-    ctx = USER_CTX.get(cb.from_user.id, {})
-    ctx.update({"platform": platform})
-    # reset deeper selections
-    ctx.pop("service", None)
-    ctx.pop("qty", None)
-    ctx.pop("price", None)
-    ctx.pop("awaiting_proof", None)
-    USER_CTX[cb.from_user.id] = ctx
+    # save selection, deeper levels start over
+    await SESSIONS.put("user", cb.from_user.id, UserSession(platform=platform))
 
     await safe_answer(cb, "✅")
     await cb.message.edit_text(t(lang, "choose_service"),
                                reply_markup=kb_services(lang, platform),
                                parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("srv:"))
-async def on_service(cb: CallbackQuery):
-    lang = db_get_lang(cb.from_user.id)
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 2:
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-        return
-    _, service = parts
+@callback_route("srv", str)
+async def on_service(cb: CallbackQuery, data: ParsedCallback):
+    lang = await db_get_lang(cb.from_user.id)
+    service, = data.args
 
-    ctx = USER_CTX.get(cb.from_user.id)
-    if not ctx or "platform" not in ctx:
+    sess = await SESSIONS.get("user", cb.from_user.id)
+    if not sess or not sess.platform:
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    platform = ctx["platform"]
+    platform = sess.platform
     if service not in SERVICES.get(platform, {}):
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    ctx.update({"service": service})
-    ctx.pop("qty", None)
-    ctx.pop("price", None)
-    ctx.pop("awaiting_proof", None)
-    USER_CTX[cb.from_user.id] = ctx
+    await SESSIONS.put("user", cb.from_user.id, UserSession(platform=platform, service=service))
 
     await safe_answer(cb, "✅")
     await cb.message.edit_text(t(lang, "choose_pack"),
                                reply_markup=kb_packs(lang, platform, service),
                                parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("pack:"))
-async def on_pack(cb: CallbackQuery):
-    lang = db_get_lang(cb.from_user.id)
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 3:
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
-        return
+@callback_route("pack", str, int)
+async def on_pack(cb: CallbackQuery, data: ParsedCallback):
+    lang = await db_get_lang(cb.from_user.id)
+    service, qty = data.args
 
-    _, service, qty_s = parts
-    if not qty_s.isdigit():
+    sess = await SESSIONS.get("user", cb.from_user.id)
+    if not sess or not sess.platform:
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
-    qty = int(qty_s)
 
-    ctx = USER_CTX.get(cb.from_user.id)
-    if not ctx or "platform" not in ctx:
+    platform = sess.platform
+    if service not in SERVICES.get(platform, {}):
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    platform = ctx["platform"]
-    if service not in SERVICES.get(platform, {}):
+    price = await db_get_price(platform, service, qty)
+    if price is None:
+        # a pack removed since this keyboard was sent
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
-
-    price = db_get_price(platform, service, qty)
-    ctx.update({"service": service, "qty": qty, "price": price})
-    ctx.pop("awaiting_proof", None)
-    USER_CTX[cb.from_user.id] = ctx
+    await SESSIONS.put("user", cb.from_user.id,
+                       UserSession(platform=platform, service=service, qty=qty, price=price))
 
     plat_t = platform_title(lang, platform)
     srv_t = service_title(lang, platform, service)
@@ -848,168 +2936,515 @@ async def on_pack(cb: CallbackQuery):
     await safe_answer(cb, "✅")
     await cb.message.edit_text(text, reply_markup=kb_final(lang), parse_mode=ParseMode.HTML)
 
+async def show_my_orders(cb: CallbackQuery, lang: str, direction: str = "n", cursor: int = None):
+    # page of "My orders", newest first; ◀️ = newer, ▶️ = older
+    if direction == "p":
+        rows, more = await db_list_orders_by_user(cb.from_user.id, after_id=cursor)
+        has_newer, has_older = more, True
+    else:
+        rows, more = await db_list_orders_by_user(cb.from_user.id, before_id=cursor)
+        has_newer, has_older = cursor is not None, more
+    if not rows:
+        if cursor is not None:
+            # the page emptied under us, start from the top
+            await show_my_orders(cb, lang)
+            return
+        await cb.message.edit_text(t(lang, "my_orders_empty"),
+                                   reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+        return
+    lines = [t(lang, "my_orders_title")]
+    for r in rows:
+        plat_t = platform_title(lang, r["platform"])
+        srv_t = service_title(lang, r["platform"], r["service"])
+        lines.append(t(lang, "order_row",
+                       id=r["id"], platform=plat_t, service=srv_t, qty=r["qty"], status=r["status"]))
+    kb = kb_page(kb_home(lang), lang, "ord",
+                 prev_cursor=rows[0]["id"] if has_newer else None,
+                 next_cursor=rows[-1]["id"] if has_older else None)
+    await cb.message.edit_text("\n".join(lines), reply_markup=kb, parse_mode=ParseMode.HTML)
+
+async def show_pending(cb: CallbackQuery, lang: str, direction: str = "n", cursor: int = None):
+    # page of pending orders, oldest first
+    if direction == "p":
+        rows, more = await db_list_pending_orders(before_id=cursor)
+        has_prev, has_next = more, True
+    else:
+        rows, more = await db_list_pending_orders(after_id=cursor)
+        has_prev, has_next = cursor is not None, more
+    if not rows:
+        if cursor is not None:
+            await show_pending(cb, lang)
+            return
+        await cb.message.edit_text(t(lang, "admin_pending_empty"),
+                                   reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
+        return
+    lines = []
+    for r in rows:
+        lines.append(t(lang, "admin_pending_row",
+                       id=r["id"], user_id=r["user_id"],
+                       platform=r["platform"], service=r["service"],
+                       qty=r["qty"], price=r["price"], status=r["status"]))
+    kb = kb_page(kb_admin(lang), lang, "pend",
+                 prev_cursor=rows[0]["id"] if has_prev else None,
+                 next_cursor=rows[-1]["id"] if has_next else None)
+    await cb.message.edit_text(t(lang, "admin_pending_title", rows="\n".join(lines)),
+                               reply_markup=kb, parse_mode=ParseMode.HTML)
+
+@callback_route("ord", str, int)
+async def on_orders_page(cb: CallbackQuery, data: ParsedCallback):
+    lang = await db_get_lang(cb.from_user.id)
+    direction, cursor = data.args
+    if direction not in ("n", "p"):
+        await on_unknown_callback(cb)
+        return
+    await safe_answer(cb, "✅")
+    await show_my_orders(cb, lang, direction, cursor)
+
+@callback_route("pend", str, int)
+async def on_pending_page(cb: CallbackQuery, data: ParsedCallback):
+    user_id = cb.from_user.id
+    lang = await db_get_lang(user_id)
+    if not is_admin(user_id):
+        await safe_answer(cb, "⛔️")
+        await cb.message.edit_text(t(lang, "admin_only"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+        return
+    direction, cursor = data.args
+    if direction not in ("n", "p"):
+        await on_unknown_callback(cb)
+        return
+    await safe_answer(cb, "✅")
+    await show_pending(cb, lang, direction, cursor)
+
+# ----- price import / export -----
+
+# parsed uploads waiting for confirmation: token -> (admin_id, catalog version, {(plat, srv, qty): price})
+PRICE_IMPORTS = LRUCache(maxsize=64, ttl=PRICE_IMPORT_TTL)
+_price_import_ids = itertools.count(1)
+
+async def send_price_export(message: Message, fmt: str = "csv"):
+    data = export_prices(CATALOG, fmt)
+    await message.answer_document(
+        BufferedInputFile(data, filename=f"prices.{fmt}"),
+        caption=f"prices v{CATALOG.version}: {len(CATALOG)} rows",
+    )
+
+@dp.message(Command("prices_export"))
+async def cmd_prices_export(message: Message, command: CommandObject):
+    user_id = message.from_user.id
+    lang = await db_get_lang(user_id)
+    if not is_admin(user_id):
+        await message.answer(t(lang, "admin_only"), parse_mode=ParseMode.HTML)
+        return
+    fmt = (command.args or "csv").strip().lower()
+    await send_price_export(message, "json" if fmt == "json" else "csv")
+
+async def _awaiting_price_import(message: Message) -> bool:
+    if not is_admin(message.from_user.id):
+        return False
+    sess = await SESSIONS.get("admin", message.from_user.id)
+    return bool(sess) and sess.mode == "priceimport"
+
+@dp.message(F.document, _awaiting_price_import)
+async def on_price_import(message: Message, bot: Bot):
+    # registered before on_proof: in import mode an admin's document is a price file, not a receipt
+    user_id = message.from_user.id
+    lang = await db_get_lang(user_id)
+    doc = message.document
+    if doc.file_size and doc.file_size > PRICE_IMPORT_MAX_BYTES:
+        await message.answer(t(lang, "admin_import_errors", count=1,
+                               errors=f"file is larger than {PRICE_IMPORT_MAX_BYTES} bytes"),
+                             parse_mode=ParseMode.HTML)
+        return
+    buf = await bot.download(doc)
+    prices, errors = parse_price_file(doc.file_name or "", buf.read())
+    if errors:
+        shown = "\n".join(f"• {html.escape(e)}" for e in errors[:20])
+        if len(errors) > 20:
+            shown += f"\n… +{len(errors) - 20}"
+        await message.answer(t(lang, "admin_import_errors", count=len(errors), errors=shown),
+                             parse_mode=ParseMode.HTML)
+        return
+
+    version = CATALOG.version
+    added, changed, removed = diff_prices(CATALOG, prices)
+    if not (added or changed or removed):
+        await message.answer(t(lang, "admin_import_nochange"), parse_mode=ParseMode.HTML)
+        return
+    lines = [f"+ {p}/{s}/{q}: {new}₸" for (p, s, q), new in added]
+    lines += [f"~ {p}/{s}/{q}: {old}₸ → {new}₸" for (p, s, q), old, new in changed]
+    lines += [f"- {p}/{s}/{q}: {old}₸" for (p, s, q), old in removed]
+    shown = "\n".join(html.escape(line) for line in lines[:40])
+    if len(lines) > 40:
+        shown += f"\n… +{len(lines) - 40}"
+
+    token = next(_price_import_ids)
+    PRICE_IMPORTS.set(token, (user_id, version, prices))
+    kb = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=t(lang, "btn_apply"), callback_data=f"pimp:apply:{token}"),
+        InlineKeyboardButton(text=t(lang, "btn_cancel"), callback_data=f"pimp:cancel:{token}"),
+    ]])
+    await message.answer(t(lang, "admin_import_diff", added=len(added), changed=len(changed),
+                           removed=len(removed), lines=shown),
+                         reply_markup=kb, parse_mode=ParseMode.HTML)
+
+@callback_route("pimp", str, int)
+async def on_price_import_confirm(cb: CallbackQuery, data: ParsedCallback):
+    user_id = cb.from_user.id
+    lang = await db_get_lang(user_id)
+    action, token = data.args
+    entry = PRICE_IMPORTS.get(token)
+    await safe_answer(cb, "✅")
+    if not is_admin(user_id) or entry is MISSING or entry[0] != user_id:
+        await cb.message.answer(t(lang, "admin_import_expired"), parse_mode=ParseMode.HTML)
+        return
+    PRICE_IMPORTS.pop(token)
+    await cb.message.edit_reply_markup(reply_markup=None)
+    if action != "apply":
+        await cb.message.answer(t(lang, "admin_import_cancelled"), parse_mode=ParseMode.HTML)
+        return
+    _, version, prices = entry
+    applied = await db_replace_prices(prices, version)
+    if applied is None:
+        await cb.message.answer(t(lang, "admin_import_stale"), parse_mode=ParseMode.HTML)
+        return
+    await SESSIONS.drop("admin", user_id)
+    EVENTS.publish(PRICE_CHANGED, rows=applied, version=CATALOG.version)
+    await cb.message.answer(t(lang, "admin_import_applied", count=applied, version=CATALOG.version),
+                            reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
+
 @dp.message(F.photo | F.document)
 async def on_proof(message: Message, bot: Bot):
     user_id = message.from_user.id
-    lang = db_get_lang(user_id)
-
-    ctx = USER_CTX.get(user_id)
-    if not ctx or not ctx.get("awaiting_proof"):
+    lang = await db_get_lang(user_id)
+
+    source_key = f"{message.chat.id}:{message.message_id}"
+    sess = await SESSIONS.get("user", user_id)
+    if not sess or not sess.awaiting_proof:
+        # a redelivered receipt lands here once the first copy cleared awaiting_proof
+        order_id = await db_find_order_by_source(source_key)
+        if order_id is not None:
+            logger.info(f"Receipt message {message.message_id} from user {user_id} already made order #{order_id}")
+            await message.answer(t(lang, "check_received"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+            return
         # ignore or guide
         await message.answer(t(lang, "need_check_first"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    platform = ctx.get("platform")
-    service = ctx.get("service")
-    qty = ctx.get("qty")
-    price = ctx.get("price")
+    platform = sess.platform
+    service = sess.service
+    qty = sess.qty
+    price = sess.price
 
-    if not (platform and service and qty and price is not None):
+    if not sess.has_pack():
         await message.answer(t(lang, "need_check_first"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
     # determine file_id and type
     proof_type = "document"
     proof_file_id = None
+    proof_unique_id = None
     if message.photo:
         proof_type = "photo"
         proof_file_id = message.photo[-1].file_id
+        proof_unique_id = message.photo[-1].file_unique_id
     elif message.document:
         proof_type = "document"
         proof_file_id = message.document.file_id
+        proof_unique_id = message.document.file_unique_id
 
-    # save order
-    order_id = db_create_order(
+    # save order, once per source message and once per receipt file
+    order = dict(
         user_id=user_id,
         platform=platform,
         service=service,
         qty=int(qty),
         price=int(price),
         proof_file_id=proof_file_id or "",
-        proof_type=proof_type
-    )
-
-    # forward to admins
-    plat_ru = platform_title("ru", platform)
-    srv_ru = service_title("ru", platform, service)
-    caption = (
-        f"🧾 <b>Новый чек/скрин</b>\n"
-        f"🆔 Order: <b>#{order_id}</b>\n"
-        f"👤 User: <code>{user_id}</code>\n"
-        f"📌 {plat_ru} / {srv_ru} / {qty}\n"
-        f"💰 {price}₸\n"
-        f"Статус: <b>pending</b>"
+        proof_type=proof_type,
     )
+    result = await db_create_order(**order, source_key=source_key, receipt_key=proof_unique_id)
+    order_id = result["order_id"]
+
+    if result["status"] == "duplicate":
+        # keep awaiting_proof: the user can still send the right receipt
+        logger.warning(f"Duplicate receipt from user {user_id}: already used by order #{order_id} "
+                       f"of user {result['owner_id']}")
+        await message.answer(t(lang, "proof_duplicate", id=order_id), reply_markup=kb_home(lang),
+                             parse_mode=ParseMode.HTML)
+        EVENTS.publish(RECEIPT_DUPLICATE, bot=bot, message=message, order_id=order_id,
+                       owner_id=result["owner_id"], **order)
+        return
 
-    for admin_id in ADMIN_IDS:
-        try:
-            if proof_type == "photo" and message.photo:
-                await bot.send_photo(admin_id, proof_file_id, caption=caption, parse_mode=ParseMode.HTML)
-            elif proof_type == "document" and message.document:
-                await bot.send_document(admin_id, proof_file_id, caption=caption, parse_mode=ParseMode.HTML)
-            else:
-                # fallback forward original message
-                await message.forward(admin_id)
-                await bot.send_message(admin_id, caption, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.warning(f"Failed to notify admin {admin_id}: {e}")
+    if result["status"] == "replayed":
+        # the same message again (redelivered update): the order and admin notice already exist
+        logger.info(f"Receipt message {message.message_id} from user {user_id} already made order #{order_id}")
+        sess.awaiting_proof = False
+        await SESSIONS.put("user", user_id, sess)
+        await message.answer(t(lang, "check_received"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+        return
 
     # clear awaiting mode
-    ctx["awaiting_proof"] = False
-    USER_CTX[user_id] = ctx
+    sess.awaiting_proof = False
+    await SESSIONS.put("user", user_id, sess)
 
+    # confirm to the user first; admin notice and metrics run off the event bus
     await message.answer(t(lang, "check_received"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
+    EVENTS.publish(ORDER_CREATED, bot=bot, message=message, order_id=order_id, **order)
 
 @dp.message(Command("admin"))
 async def cmd_admin(message: Message):
     user_id = message.from_user.id
-    lang = db_get_lang(user_id)
+    lang = await db_get_lang(user_id)
     if not is_admin(user_id):
         await message.answer(t(lang, "admin_only"), parse_mode=ParseMode.HTML)
         return
-    ADMIN_STATE.pop(user_id, None)
+    await SESSIONS.drop("admin", user_id)
     await message.answer(t(lang, "admin_menu_title"), reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
 
-@dp.callback_query(F.data.startswith("admin:"))
-async def on_admin(cb: CallbackQuery):
+@dp.message(Command("recount"))
+async def cmd_recount(message: Message):
+    # consistency check: recount order counters from `orders`, fix and report drift
+    user_id = message.from_user.id
+    lang = await db_get_lang(user_id)
+    if not is_admin(user_id):
+        await message.answer(t(lang, "admin_only"), parse_mode=ParseMode.HTML)
+        return
+    drift = await db_rebuild_order_counters()
+    if not drift["users"] and not drift["statuses"]:
+        await message.answer(t(lang, "admin_recount_ok"), parse_mode=ParseMode.HTML)
+        return
+    statuses = ", ".join(f"{st}: {d:+d}" for st, d in sorted(drift["statuses"].items())) or "-"
+    logger.warning(f"Order counters drifted and were rebuilt: users={drift['users']} statuses={statuses}")
+    await message.answer(t(lang, "admin_recount_fixed", users=drift["users"], statuses=statuses),
+                         parse_mode=ParseMode.HTML)
+
+# ----- profiling: /slow, /profile, /memprof -----
+
+_PROFILERS = {}  # "profile" -> (cProfile.Profile, started), "memprof" -> (baseline snapshot, started)
+
+def _slow_report() -> bytes:
+    lines = [f"updates slower than {SLOW_UPDATE_MS} ms, newest first (last {SLOW_UPDATES.maxlen} kept)", ""]
+    lines.append(f"{'time':<20}{'total':>9}{'db':>9}{'api':>9}{'other':>9}  handler / update")
+    for r in reversed(SLOW_UPDATES):
+        lines.append(
+            f"{datetime.fromtimestamp(r['at']).strftime('%Y-%m-%d %H:%M:%S'):<20}"
+            f"{r['total'] * 1000:>7.0f}ms{r['db'] * 1000:>7.0f}ms{r['api'] * 1000:>7.0f}ms{r['other'] * 1000:>7.0f}ms"
+            f"  {r['handler']} [{r['kind']} {r['data']}] db_calls={r['db_calls']} api_calls={r['api_calls']}"
+            f" update_id={r['update_id']} trace_id={r['trace_id']}"
+        )
+    return "\n".join(lines).encode()
+
+def _cpu_report(prof: cProfile.Profile, elapsed: float) -> bytes:
+    out = io.StringIO()
+    out.write(f"cProfile, event loop thread, {elapsed:.1f}s\n\n")
+    stats = pstats.Stats(prof, stream=out)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+    stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+    return out.getvalue().encode()
+
+def _mem_report(baseline: tracemalloc.Snapshot, elapsed: float) -> bytes:
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"tracemalloc, {elapsed:.1f}s, traced now {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB", "",
+             f"top {PROFILE_TOP} growth since start:"]
+    lines += [str(s) for s in snapshot.compare_to(baseline, "lineno")[:PROFILE_TOP]]
+    lines += ["", f"top {PROFILE_TOP} allocations now:"]
+    lines += [str(s) for s in snapshot.statistics("lineno")[:PROFILE_TOP]]
+    return "\n".join(lines).encode()
+
+async def _admin_command(message: Message):
+    # -> lang for admins, None (after replying) for everyone else
+    lang = await db_get_lang(message.from_user.id)
+    if not is_admin(message.from_user.id):
+        await message.answer(t(lang, "admin_only"), parse_mode=ParseMode.HTML)
+        return None
+    return lang
+
+@dp.message(Command("slow"))
+async def cmd_slow(message: Message):
+    lang = await _admin_command(message)
+    if lang is None:
+        return
+    if not SLOW_UPDATES:
+        await message.answer(t(lang, "admin_slow_empty", ms=SLOW_UPDATE_MS), parse_mode=ParseMode.HTML)
+        return
+    await message.answer_document(BufferedInputFile(_slow_report(), filename="slow-updates.txt"),
+                                  caption=f"{len(SLOW_UPDATES)} slow updates (≥ {SLOW_UPDATE_MS} ms)")
+
+@dp.message(Command("profile", "memprof"))
+async def cmd_profile(message: Message, command: CommandObject):
+    lang = await _admin_command(message)
+    if lang is None:
+        return
+    name, action = command.command, (command.args or "").strip().lower()
+    if action not in ("start", "stop"):
+        await message.answer(t(lang, "admin_prof_usage"), parse_mode=ParseMode.HTML)
+        return
+    running = _PROFILERS.get(name)
+    if action == "start":
+        if running is not None:
+            await message.answer(t(lang, "admin_prof_already", name=name), parse_mode=ParseMode.HTML)
+            return
+        if name == "profile":
+            prof = cProfile.Profile()
+            prof.enable()
+            _PROFILERS[name] = (prof, time.monotonic())
+        else:
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+            _PROFILERS[name] = (tracemalloc.take_snapshot(), time.monotonic())
+        logger.info(f"{name} started by admin {message.from_user.id}")
+        await message.answer(t(lang, "admin_prof_started", name=name), parse_mode=ParseMode.HTML)
+        return
+
+    if running is None:
+        await message.answer(t(lang, "admin_prof_idle", name=name), parse_mode=ParseMode.HTML)
+        return
+    del _PROFILERS[name]
+    state, started = running
+    elapsed = time.monotonic() - started
+    if name == "profile":
+        state.disable()
+        report = _cpu_report(state, elapsed)
+    else:
+        report = _mem_report(state, elapsed)
+        tracemalloc.stop()
+    logger.info(f"{name} stopped by admin {message.from_user.id} after {elapsed:.1f}s")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await message.answer_document(BufferedInputFile(report, filename=f"{name}-{stamp}.txt"),
+                                  caption=f"{name}: {elapsed:.1f}s")
+
+@callback_route("admin", str)
+async def on_admin(cb: CallbackQuery, data: ParsedCallback):
     user_id = cb.from_user.id
-    lang = db_get_lang(user_id)
+    lang = await db_get_lang(user_id)
 
     if not is_admin(user_id):
         await safe_answer(cb, "⛔️")
         await cb.message.edit_text(t(lang, "admin_only"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
         return
 
-    parts = parse_cb(cb.data)
-    if not parts or len(parts) != 2:
-        await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
-        return
-
-    _, action = parts
+    action, = data.args
     await safe_answer(cb, "✅")
 
     if action == "pending":
-        rows = db_list_pending_orders(limit=30)
-        if not rows:
-            await cb.message.edit_text(t(lang, "admin_pending_empty"),
-                                       reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
-            return
-        lines = []
-        for r in rows:
-            lines.append(t(lang, "admin_pending_row",
-                           id=r["id"], user_id=r["user_id"],
-                           platform=r["platform"], service=r["service"],
-                           qty=r["qty"], price=r["price"], status=r["status"]))
-        await cb.message.edit_text(t(lang, "admin_pending_title", rows="\n".join(lines)),
-                                   reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
+        await show_pending(cb, lang)
         return
 
     if action == "done":
-        ADMIN_STATE[user_id] = {"mode": "done"}
+        await SESSIONS.put("admin", user_id, AdminSession("done"))
         await cb.message.edit_text(t(lang, "admin_ask_order_id_done"),
                                    reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
         return
 
     if action == "cancel":
-        ADMIN_STATE[user_id] = {"mode": "cancel"}
+        await SESSIONS.put("admin", user_id, AdminSession("cancel"))
         await cb.message.edit_text(t(lang, "admin_ask_order_id_cancel"),
                                    reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
         return
 
     if action == "prices":
-        ADMIN_STATE[user_id] = {"mode": "setprice"}
+        await SESSIONS.put("admin", user_id, AdminSession("setprice"))
         await cb.message.edit_text(t(lang, "admin_prices_help"),
                                    reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
         return
 
+    if action == "import":
+        await SESSIONS.put("admin", user_id, AdminSession("priceimport"))
+        await cb.message.edit_text(t(lang, "admin_import_help"),
+                                   reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
+        await send_price_export(cb.message)
+        return
+
+    if action == "stats":
+        counts = await db_order_status_counts()
+        await cb.message.edit_text(t(lang, "admin_stats_text",
+                                     pending=counts.get("pending", 0),
+                                     done=counts.get("done", 0),
+                                     cancel=counts.get("cancel", 0),
+                                     total=sum(counts.values())),
+                                   reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
+        return
+
     await cb.message.edit_text(t(lang, "unknown_callback"),
                                reply_markup=kb_admin(lang), parse_mode=ParseMode.HTML)
 
+# bulk status changes that can still be undone: op_id -> (admin_id, status, {order_id: old_status})
+BULK_UNDO = LRUCache(maxsize=256, ttl=BULK_UNDO_WINDOW)
+_bulk_ops = itertools.count(1)
+
+@callback_route("undo", int)
+async def on_undo(cb: CallbackQuery, data: ParsedCallback):
+    user_id = cb.from_user.id
+    lang = await db_get_lang(user_id)
+    op_id, = data.args
+    entry = BULK_UNDO.get(op_id)
+    if not is_admin(user_id) or entry is MISSING or entry[0] != user_id:
+        await safe_answer(cb, "⌛️")
+        await cb.message.edit_reply_markup(reply_markup=None)
+        await cb.message.answer(t(lang, "admin_undo_expired"), parse_mode=ParseMode.HTML)
+        return
+    BULK_UNDO.pop(op_id)
+    _, status, previous = entry
+    restored = await db_restore_order_statuses(previous, status)
+    for r in restored:
+        EVENTS.publish(ORDER_STATUS_CHANGED, bot=cb.bot, order_id=r["id"], user_id=r["user_id"],
+                       platform=r["platform"], service=r["service"], qty=r["qty"],
+                       old=status, new=previous[r["id"]])
+    await safe_answer(cb, "↩️")
+    await cb.message.edit_reply_markup(reply_markup=None)
+    await cb.message.answer(t(lang, "admin_undo_ok", count=len(restored), total=len(previous)),
+                            parse_mode=ParseMode.HTML)
+
 @dp.message()
-async def on_text(message: Message):
+async def on_text(message: Message, bot: Bot):
     # handle admin numeric input / setprice
     user_id = message.from_user.id
-    lang = db_get_lang(user_id)
+    lang = await db_get_lang(user_id)
 
-    if is_admin(user_id) and user_id in ADMIN_STATE:
-        mode = ADMIN_STATE[user_id].get("mode")
+    admin_sess = await SESSIONS.get("admin", user_id) if is_admin(user_id) else None
+    if admin_sess:
+        mode = admin_sess.mode
 
         if mode in ("done", "cancel"):
-            txt = (message.text or "").strip()
-            if not txt.isdigit():
+            # one id, a list or ranges: "12", "12,15,20-80"
+            order_ids = parse_id_list(message.text or "", BULK_MAX_IDS)
+            if not order_ids:
                 await message.answer(t(lang, "admin_bad_id"), parse_mode=ParseMode.HTML)
                 return
-            order_id = int(txt)
             new_status = "done" if mode == "done" else "cancel"
-            ok = db_update_order_status(order_id, new_status)
-            if not ok:
+            result = await db_bulk_update_order_status(order_ids, new_status)
+            if not result["updated"] and not result["unchanged"]:
                 await message.answer(t(lang, "admin_bad_id"), parse_mode=ParseMode.HTML)
                 return
-            ADMIN_STATE.pop(user_id, None)
-            if new_status == "done":
-                await message.answer(t(lang, "admin_done_ok", id=order_id), parse_mode=ParseMode.HTML)
-            else:
-                await message.answer(t(lang, "admin_cancel_ok", id=order_id), parse_mode=ParseMode.HTML)
+            await SESSIONS.drop("admin", user_id)
+            for order_id in result["updated"]:
+                EVENTS.publish(ORDER_STATUS_CHANGED, bot=bot, order_id=order_id, **result["orders"][order_id],
+                               old=result["previous"][order_id], new=new_status)
+
+            kb = None
+            if result["updated"]:
+                op_id = next(_bulk_ops)
+                BULK_UNDO.set(op_id, (user_id, new_status, result["previous"]))
+                kb = InlineKeyboardMarkup(inline_keyboard=[[
+                    InlineKeyboardButton(text=t(lang, "btn_undo"), callback_data=f"undo:{op_id}")
+                ]])
+            if len(order_ids) == 1 and result["updated"]:
+                key = "admin_done_ok" if new_status == "done" else "admin_cancel_ok"
+                await message.answer(t(lang, key, id=order_ids[0]), reply_markup=kb, parse_mode=ParseMode.HTML)
+                return
+            lines = [t(lang, "admin_bulk_title", status=new_status,
+                       updated=len(result["updated"]), total=len(order_ids))]
+            if result["updated"]:
+                lines.append(t(lang, "admin_bulk_updated", ids=format_id_ranges(result["updated"])))
+            if result["unchanged"]:
+                lines.append(t(lang, "admin_bulk_unchanged", status=new_status,
+                               ids=format_id_ranges(result["unchanged"])))
+            if result["missing"]:
+                lines.append(t(lang, "admin_bulk_missing", ids=format_id_ranges(result["missing"])))
+            await message.answer("\n".join(lines), reply_markup=kb, parse_mode=ParseMode.HTML)
             return
 
         if mode == "setprice":
@@ -1026,7 +3461,8 @@ async def on_text(message: Message):
                 await message.answer(t(lang, "admin_setprice_bad"), parse_mode=ParseMode.HTML)
                 return
 
-            db_set_price(platform, service, qty, price)
+            await db_set_price(platform, service, qty, price)
+            EVENTS.publish(PRICE_CHANGED, rows=1, version=CATALOG.version)
             await message.answer(t(lang, "admin_setprice_ok",
                                    platform=platform, service=service, qty=qty, price=price),
                                  parse_mode=ParseMode.HTML)
@@ -1036,8 +3472,17 @@ async def on_text(message: Message):
     await send_home(message, lang)
 
 @dp.callback_query()
+async def on_callback(cb: CallbackQuery):
+    # single entry point: parse once, dispatch by prefix, reject malformed here
+    data = parse_callback(cb.data)
+    if data is None:
+        await on_unknown_callback(cb)
+        return
+    handler = CALLBACK_ROUTES[data.prefix][0]
+    await handler(cb, data)
+
 async def on_unknown_callback(cb: CallbackQuery):
-    lang = db_get_lang(cb.from_user.id)
+    lang = await db_get_lang(cb.from_user.id)
     await safe_answer(cb, "⚠️")
     try:
         await cb.message.edit_text(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
@@ -1045,20 +3490,535 @@ async def on_unknown_callback(cb: CallbackQuery):
         # if message can't be edited
         await cb.message.answer(t(lang, "unknown_callback"), reply_markup=kb_home(lang), parse_mode=ParseMode.HTML)
 
+# ===================== Metrics endpoint =====================
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware: times the handler that actually runs, by its function name."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        if isinstance(event, CallbackQuery) and name == "on_callback":
+            # everything routes through on_callback; label by the routed handler instead
+            route = CALLBACK_ROUTES.get((event.data or "").split(":", 1)[0])
+            name = route[0].__name__ if route else "on_unknown_callback"
+        trace = UPDATE_TRACE.get()
+        if trace is not None:
+            trace.handler = name
+        start = time.perf_counter()
+        ok = True
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            ok = False
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HANDLER_SECONDS.observe(elapsed, name)
+            log_span("handler", name, start, elapsed, ok)
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Session middleware: times every Bot API method. Registered after OUTBOUND, so limiter waits are excluded."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        ok = True
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            ok = False
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            API_SECONDS.observe(elapsed, name)
+            log_span("api", name, start, elapsed, ok, chat_id=getattr(method, "chat_id", None))
+            trace = UPDATE_TRACE.get()
+            if trace is not None:
+                trace.api += elapsed
+                trace.api_calls += 1
+
+_handler_metrics = HandlerMetrics()
+dp.message.middleware(_handler_metrics)
+dp.callback_query.middleware(_handler_metrics)
+API_METRICS = ApiMetrics()
+
+class SlowUpdateMonitor(BaseMiddleware):
+    """
+    Outer update middleware: opens an UpdateTrace (correlation id + timings)
+    for every update, logs its "update" span and keeps the ones slower than
+    SLOW_UPDATE_MS in SLOW_UPDATES (bounded ring buffer).
+    """
+
+    async def __call__(self, handler, event: Update, data):
+        trace = UpdateTrace(event.update_id, event.event_type, _update_summary(event))
+        token = UPDATE_TRACE.set(trace)
+        ok = True
+        try:
+            return await handler(event, data)
+        except Exception:
+            ok = False
+            raise
+        finally:
+            record = trace.finish()
+            log_span("update", record["handler"], trace.started, record["total"], ok,
+                     update_id=record["update_id"], kind=record["kind"], data=record["data"],
+                     db_ms=round(record["db"] * 1000, 3), api_ms=round(record["api"] * 1000, 3))
+            if record["total"] * 1000 >= SLOW_UPDATE_MS:
+                SLOW_UPDATES.append(record)
+                SLOW_UPDATES_SEEN.inc()
+                logger.warning(f"Slow update {record['update_id']}: {record['total'] * 1000:.0f} ms in "
+                               f"{record['handler']} ({record['data']}), db {record['db'] * 1000:.0f} ms, "
+                               f"api {record['api'] * 1000:.0f} ms")
+            UPDATE_TRACE.reset(token)
+
+def _update_summary(event: Update) -> str:
+    # callback data or command name only, never free text from users
+    if event.callback_query is not None:
+        return event.callback_query.data or ""
+    msg = event.message
+    if msg is not None:
+        if msg.text and msg.text.startswith("/"):
+            return msg.text.split()[0][:32]
+        return msg.content_type.value
+    return ""
+
+SLOW_UPDATES = deque(maxlen=SLOW_UPDATES_MAX)
+SLOW_UPDATES_SEEN = METRICS.counter("bot_slow_updates_total", "Updates slower than SLOW_UPDATE_MS")
+dp.update.outer_middleware(SlowUpdateMonitor())
+
+def _cache_gauge(field: str):
+    def read():
+        caches = {("lang",): LANG_CACHE, ("bulk_undo",): BULK_UNDO, ("price_import",): PRICE_IMPORTS,
+                  ("render",): RENDERS._last}
+        for kind, cache in getattr(SESSIONS, "_caches", {}).items():
+            caches[(f"session_{kind}",)] = cache
+        return {labels: cache.stats()[field] for labels, cache in caches.items()}
+    return read
+
+METRICS.gauge("bot_cache_hit_ratio", "LRU cache hit ratio since start", _cache_gauge("hit_rate"), ("cache",))
+METRICS.gauge("bot_cache_entries", "LRU cache size", _cache_gauge("size"), ("cache",))
+METRICS.gauge("bot_outbound_queue_depth", "Sends waiting for a global token, by lane",
+              lambda: {(lane,): n for lane, n in OUTBOUND.stats()["queue_depth"].items()}, ("lane",))
+METRICS.gauge("bot_outbound_total", "Outbound limiter counters",
+              lambda: {(k,): v for k, v in OUTBOUND.counters.items()}, ("event",), kind="counter")
+METRICS.gauge("bot_render_edits_total", "editMessageText calls: sent, skipped as unchanged, rejected as not modified",
+              lambda: {(k,): v for k, v in RENDERS.counters.items()}, ("result",), kind="counter")
+METRICS.gauge("bot_write_queue_depth", "Write intents waiting for the next group commit",
+              lambda: WRITES.stats()["queued"])
+METRICS.gauge("bot_write_batches_total", "Group commits done", lambda: WRITES.batches, kind="counter")
+METRICS.gauge("bot_session_dirty", "Sessions not yet flushed to SQLite",
+              lambda: len(getattr(SESSIONS, "_dirty", ())))
+METRICS.gauge("bot_background_tasks", "Running background tasks (admin notifications)",
+              lambda: len(_BACKGROUND_TASKS))
+METRICS.gauge("bot_admin_notify_total", "Receipt notifications to admins",
+              lambda: {(k,): v for k, v in ADMIN_NOTIFY_STATS.items()}, ("result",), kind="counter")
+METRICS.gauge("bot_customer_notify_total", "Order status messages to customers",
+              lambda: {(k,): v for k, v in CUSTOMER_NOTIFY_STATS.items()}, ("result",), kind="counter")
+METRICS.gauge("bot_event_queue_depth", "Events waiting per subscriber",
+              lambda: {(sub.name,): sub.stats()["queued"] for sub in EVENTS.subscribers}, ("subscriber",))
+METRICS.gauge("bot_events_delivered_total", "Events per subscriber: handled, failed, dropped on a full queue",
+              lambda: {(sub.name, k): v for sub in EVENTS.subscribers for k, v in sub.counters.items()},
+              ("subscriber", "result"), kind="counter")
+METRICS.gauge("bot_catalog_version", "Version of the live price catalog", lambda: CATALOG.version)
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(body=METRICS.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_metrics_server():
+    # plain HTTP on a local port, separate from the webhook; returns the runner or None
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+# ===================== Webhook =====================
+
+class _WebhookHandler(SimpleRequestHandler):
+    async def close(self):
+        # the app's shutdown would close bot.session; main() does that after the event bus drained
+        pass
+
+def build_webhook_app(bot: Bot) -> web.Application:
+    """aiohttp app that checks X-Telegram-Bot-Api-Secret-Token and feeds updates to dp."""
+    app = web.Application()
+    _WebhookHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None,
+        # shard worker: answer only once the update is handled, so the ingress lane
+        # posting it knows the user's previous update is done before sending the next
+        handle_in_background=SHARD_INDEX < 0,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def serve_webhook(bot: Bot, app: web.Application, name: str):
+    """Register the webhook with Telegram (if WEBHOOK_URL) and serve `app` until cancelled."""
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is empty: webhook requests are not authenticated")
+    if WEBHOOK_URL:
+        # without WEBHOOK_URL the webhook is assumed to be registered already (or local testing)
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"{name} on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def run_webhook(bot: Bot):
+    await serve_webhook(bot, build_webhook_app(bot), "Webhook listening")
+
+# ===================== Sharding =====================
+# WORKERS=N: this process becomes the ingress + supervisor. It receives updates
+# (polling or webhook) and forwards each one to worker `shard_for(update)`:
+# a child process running this same file in local webhook mode (SHARD_INDEX=i).
+# A user always lands on the same worker, so their session, lang cache and
+# undo/import state stay local; prices are shared through SQLite (meta.price_rev).
+# Inside a worker, a user also always lands on the same forwarding lane, and a
+# lane posts its next update only after the worker has handled the previous one:
+# each user's updates run in order while SHARD_LANES users proceed in parallel.
+
+def _shard_hash(update: dict) -> int:
+    # first from.id / user.id / chat.id found in the update's payload, else update_id
+    key = update.get("update_id", 0)
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        who = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(who, dict) and "id" in who:
+            key = who["id"]
+            break
+    # Fibonacci hashing: the high bits of key * 2^32/phi are well mixed even for consecutive ids
+    return (key * 0x9E3779B1) & 0xFFFFFFFF
+
+def shard_for(update: dict, workers: int) -> int:
+    # h / 2^32 * workers: picks by the high bits, for any number of workers
+    return (_shard_hash(update) * workers) >> 32
+
+def shard_lane(update: dict, workers: int, lanes: int) -> int:
+    # the fraction left after picking the worker, so lanes stay even within a worker
+    return (((_shard_hash(update) * workers) & 0xFFFFFFFF) * lanes) >> 32
+
+class ShardWorker:
+    """One worker process plus its lanes: ordered queues of updates waiting to be forwarded to it."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port = SHARD_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}/update"
+        lanes = max(1, SHARD_LANES)
+        self.lanes = [asyncio.Queue(maxsize=max(1, SHARD_QUEUE_MAX // lanes)) for _ in range(lanes)]
+        self.proc = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.forwarded = 0
+        self.failed = 0  # updates whose handler raised in the worker
+        self.post_errors = 0
+        self.posts = deque(maxlen=1000)  # recent forward round trips, seconds
+
+    def env(self, secret: str, workers: int) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "SHARD_INDEX": str(self.index),
+            "BOT_MODE": "webhook",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.port),
+            "WEBHOOK_PATH": "/update",
+            "WEBHOOK_URL": "",  # never register this local endpoint with Telegram
+            "WEBHOOK_SECRET": secret,
+            # the Bot API limit is per bot, split it between the workers
+            "SEND_GLOBAL_RATE": str(SEND_GLOBAL_RATE / workers),
+            "METRICS_PORT": str(METRICS_PORT + 1 + self.index) if METRICS_PORT else "0",
+        })
+        return env
+
+    async def spawn(self, secret: str, workers: int):
+        # own session: a Ctrl-C on the terminal reaches the supervisor only, which then stops workers in order
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__),
+            env=self.env(secret, workers), start_new_session=True,
+        )
+        self.started_at = time.monotonic()
+        logger.info(f"Worker {self.index} started: pid={self.proc.pid} port={self.port}")
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    def cpu_seconds(self) -> float:
+        # utime + stime from /proc (Linux); 0.0 where unavailable
+        try:
+            with open(f"/proc/{self.proc.pid}/stat") as fh:
+                fields = fh.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, AttributeError, IndexError, ValueError):
+            return 0.0
+
+    def stats(self) -> dict:
+        posts = sorted(self.posts)
+        return {
+            "pid": self.proc.pid if self.proc else None,
+            "alive": self.alive,
+            "uptime": round(time.monotonic() - self.started_at, 1) if self.alive else 0.0,
+            "restarts": self.restarts,
+            "forwarded": self.forwarded,
+            "failed": self.failed,
+            "queued": sum(q.qsize() for q in self.lanes),
+            "post_errors": self.post_errors,
+            "post_p50_ms": round(posts[len(posts) // 2] * 1000, 2) if posts else 0.0,
+            "cpu_s": round(self.cpu_seconds(), 2) if self.alive else 0.0,
+        }
+
+class ShardSupervisor:
+    """Starts N workers, restarts the ones that die, forwards updates to them in order."""
+
+    def __init__(self, workers: int):
+        self.workers = [ShardWorker(i) for i in range(workers)]
+        self.secret = secrets.token_urlsafe(24)
+        self._tasks = []
+        self._http = None
+        self._stopping = False
+
+    async def start(self):
+        # no total timeout: a post returns when the worker has handled the update, and
+        # re-posting one that merely ran long would handle it twice
+        self._http = ClientSession(timeout=ClientTimeout(total=None, sock_connect=5))
+        for w in self.workers:
+            await w.spawn(self.secret, len(self.workers))
+            self._tasks.append(asyncio.create_task(self._watch(w)))
+            for lane in w.lanes:
+                self._tasks.append(asyncio.create_task(self._forward(w, lane)))
+        self._tasks.append(asyncio.create_task(self._report()))
+
+    async def dispatch(self, update: dict):
+        # blocks when the lane is full: backpressure on polling / the webhook request
+        w = self.workers[shard_for(update, len(self.workers))]
+        await w.lanes[shard_lane(update, len(self.workers), len(w.lanes))].put(update)
+
+    async def _watch(self, w: ShardWorker):
+        backoff = 1.0
+        while True:
+            code = await w.proc.wait()
+            if self._stopping:
+                return
+            uptime = time.monotonic() - w.started_at
+            backoff = 1.0 if uptime > 60 else min(backoff * 2, 30.0)  # crash loop -> back off
+            logger.error(f"Worker {w.index} (pid {w.proc.pid}) exited with {code} after {uptime:.0f}s, "
+                         f"restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            w.restarts += 1
+            await w.spawn(self.secret, len(self.workers))
+
+    async def _forward(self, w: ShardWorker, lane: asyncio.Queue):
+        # one update at a time per lane; the worker answers after handling it, so a user's updates stay in order
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret}
+        while True:
+            update = await lane.get()
+            delay = 0.2
+            while True:
+                start = time.perf_counter()
+                try:
+                    async with self._http.post(w.url, json=update, headers=headers) as resp:
+                        if resp.status == 200:
+                            break
+                        if resp.status == 500:
+                            # the handler ran and raised (the worker logged it): posting again would re-run it
+                            w.failed += 1
+                            logger.warning(f"Worker {w.index} failed on update {update.get('update_id')}")
+                            break
+                        raise RuntimeError(f"HTTP {resp.status}")
+                except Exception as e:
+                    # worker starting up or restarting: hold the update, keep the order
+                    w.post_errors += 1
+                    if w.post_errors % 50 == 1:
+                        logger.warning(f"Worker {w.index} not accepting updates ({type(e).__name__}: {e}), retrying")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5.0)
+            w.posts.append(time.perf_counter() - start)
+            w.forwarded += 1
+            lane.task_done()
+
+    async def _report(self):
+        last = {w.index: 0 for w in self.workers}
+        while True:
+            await asyncio.sleep(SHARD_REPORT_INTERVAL)
+            for w in self.workers:
+                st = w.stats()
+                rate = (st["forwarded"] - last[w.index]) / SHARD_REPORT_INTERVAL
+                last[w.index] = st["forwarded"]
+                logger.info(f"Worker {w.index}: {rate:.1f} upd/s {st}")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        # forward what is queued, then SIGINT: workers run their normal shutdown (flush sessions/writes)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for w in self.workers for q in w.lanes)), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {sum(q.qsize() for w in self.workers for q in w.lanes)} undelivered updates")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for w in self.workers:
+            if w.alive:
+                w.proc.send_signal(signal.SIGINT)
+        for w in self.workers:
+            if w.proc is None:
+                continue
+            try:
+                await asyncio.wait_for(w.proc.wait(), 15)
+            except asyncio.TimeoutError:
+                logger.warning(f"Worker {w.index} did not stop, killing")
+                w.proc.kill()
+                await w.proc.wait()
+        await self._http.close()
+
+    def stats(self) -> dict:
+        return {w.index: w.stats() for w in self.workers}
+
+def _shard_gauges(supervisor: ShardSupervisor):
+    def per_worker(field):
+        return lambda: {(str(i),): st[field] for i, st in supervisor.stats().items()}
+    METRICS.gauge("bot_shard_alive", "1 if the worker process is running", lambda: {
+        (str(w.index),): int(w.alive) for w in supervisor.workers}, ("worker",))
+    METRICS.gauge("bot_shard_forwarded_total", "Updates forwarded to the worker",
+                  per_worker("forwarded"), ("worker",), kind="counter")
+    METRICS.gauge("bot_shard_queue_depth", "Updates waiting to be forwarded", per_worker("queued"), ("worker",))
+    METRICS.gauge("bot_shard_restarts_total", "Worker restarts", per_worker("restarts"), ("worker",), kind="counter")
+    METRICS.gauge("bot_shard_cpu_seconds", "CPU time of the current worker process", per_worker("cpu_s"), ("worker",))
+
+async def _ingress_polling(bot: Bot, supervisor: ShardSupervisor):
+    offset = None
+    allowed = dp.resolve_used_update_types()
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed,
+                                            request_timeout=35)
+        except Exception as e:
+            logger.warning(f"get_updates failed: {type(e).__name__}: {e}, retrying in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        for upd in updates:
+            await supervisor.dispatch(upd.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = upd.update_id + 1
+
+async def _ingress_webhook(bot: Bot, supervisor: ShardSupervisor):
+    async def receive(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        await supervisor.dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    await serve_webhook(bot, app, "Ingress webhook")
+
+async def run_sharded():
+    # migrate once here, before N workers open the same database
+    await db_init()
+    db_close()
+    supervisor = ShardSupervisor(WORKERS)
+    _shard_gauges(supervisor)
+    await supervisor.start()
+    metrics_runner = await start_metrics_server()
+    bot = Bot(token=BOT_TOKEN)
+    logger.info(f"Ingress started: mode={BOT_MODE} workers={WORKERS} ports={SHARD_BASE_PORT}..{SHARD_BASE_PORT + WORKERS - 1}")
+    try:
+        if BOT_MODE == "webhook":
+            await _ingress_webhook(bot, supervisor)
+        else:
+            await _ingress_polling(bot, supervisor)
+    finally:
+        await supervisor.stop()
+        logger.info(f"Workers: {supervisor.stats()}")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+
 # ===================== MAIN =====================
 
+_catalog_refresher = None
+_archiver = None
+
+async def startup():
+    global _catalog_refresher, _archiver
+    await db_init()
+    await WRITES.start()
+    await SESSIONS.start()
+    await EVENTS.start()
+    KEYBOARDS.build()
+    if SHARD_INDEX >= 0:
+        # prices may change in another worker; a single process swaps CATALOG on its own writes
+        _catalog_refresher = asyncio.create_task(_catalog_refresh_loop(CATALOG_REFRESH_INTERVAL))
+    if ARCHIVE_AFTER_DAYS > 0 and SHARD_INDEX <= 0:
+        # workers share one database: worker 0 archives for all of them
+        _archiver = asyncio.create_task(_archive_loop(ARCHIVE_INTERVAL))
+
 async def main():
     if not BOT_TOKEN:
         print("ERROR: BOT_TOKEN env is empty. Set BOT_TOKEN and restart.")
         return
+    if BOT_MODE not in ("polling", "webhook"):
+        print(f"ERROR: BOT_MODE must be 'polling' or 'webhook', got '{BOT_MODE}'.")
+        return
+    if WORKERS > 0 and SHARD_INDEX < 0:
+        await run_sharded()
+        return
 
-    db_init()
+    await startup()
     bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
+    bot.session.middleware(RENDERS)  # outermost: unchanged edits never reach the limiter
+    bot.session.middleware(OUTBOUND)
+    bot.session.middleware(API_METRICS)  # inner: measures the API call itself
+    metrics_runner = await start_metrics_server()
 
     me = await bot.get_me()
-    logger.info(f"Bot started: @{me.username} | admins={list(ADMIN_IDS)} | admin_username={ADMIN_USERNAME}")
+    logger.info(f"Bot started: @{me.username} | mode={BOT_MODE} | admins={list(ADMIN_IDS)} | admin_username={ADMIN_USERNAME}")
 
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot)
+        else:
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await EVENTS.close()
+        logger.info(f"Events: {EVENTS.stats()}")
+        if _BACKGROUND_TASKS:
+            # let in-flight notifications finish
+            await asyncio.gather(*_BACKGROUND_TASKS, return_exceptions=True)
+        await bot.session.close()  # only now: the drain above still sends notifications
+        logger.info(f"Lang cache: {LANG_CACHE.stats()}")
+        logger.info(f"Outbound: {OUTBOUND.stats()}")
+        logger.info(f"Renders: {RENDERS.stats()}")
+        await WRITES.close()
+        logger.info(f"Write batches: {WRITES.stats()}")
+        await SESSIONS.close()
+        logger.info(f"Sessions: {SESSIONS.stats()}")
+        if _catalog_refresher is not None:
+            _catalog_refresher.cancel()
+        if _archiver is not None:
+            _archiver.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        db_close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,39 @@
+"""
+POST recorded Telegram updates to a locally running webhook (BOT_MODE=webhook).
+
+    python tools/post_updates.py updates.json [--url http://127.0.0.1:8080/webhook] [--secret S]
+
+The file holds one update object or a list of them (the JSON Telegram sends,
+e.g. copied from getUpdates). Each one is sent with the
+X-Telegram-Bot-Api-Secret-Token header, exactly like Telegram does.
+"""
+import argparse
+import asyncio
+import json
+import os
+
+from aiohttp import ClientSession
+
+async def post_all(url: str, secret: str, updates):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with ClientSession() as session:
+        for upd in updates:
+            async with session.post(url, json=upd, headers=headers) as resp:
+                body = await resp.text()
+                print(f"update_id={upd.get('update_id')} -> {resp.status} {body[:200]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", help="JSON file with an update or a list of updates")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}"
+                                         f"{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    args = parser.parse_args()
+
+    with open(args.file, encoding="utf-8") as fh:
+        data = json.load(fh)
+    updates = data if isinstance(data, list) else [data]
+    asyncio.run(post_all(args.url, args.secret, updates))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Rebuild per-update timelines from the bot's JSON logs (LOG_FORMAT=json).
+
+    python tools/trace_timeline.py bot.log                 # 10 slowest updates, with timelines
+    python tools/trace_timeline.py bot.log --top 3 --min-ms 500
+    python tools/trace_timeline.py bot.log --trace 1a2b-9f3c0d12
+    cat bot.log | python tools/trace_timeline.py -
+
+Every log line carries the trace_id of the update it belongs to. Span lines
+(LOG_SPANS=1, the default with JSON logs) carry span/op/at_ms/dur_ms: the
+update itself, its handler, every db_* call, every Bot API request and every
+outbound rate-limiter wait. Plain log lines of the same update are shown at
+their wall-clock offset. Lines that are not JSON are skipped.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+BAR_WIDTH = 40
+
+def read_entries(stream):
+    for line in stream:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get("trace_id"):
+            yield entry
+
+def group_traces(entries):
+    traces = defaultdict(list)
+    for entry in entries:
+        traces[entry["trace_id"]].append(entry)
+    return traces
+
+def _update_span(entries):
+    return next((e for e in entries if e.get("span") == "update"), None)
+
+def _ts(entry) -> float:
+    return datetime.fromisoformat(entry["ts"]).timestamp()
+
+def timeline(trace_id: str, entries) -> str:
+    update = _update_span(entries)
+    total = update["dur_ms"] if update else max((e.get("at_ms") or 0) + (e.get("dur_ms") or 0) for e in entries)
+    # the update span is logged when it ends: its ts minus its duration is t=0
+    t0 = _ts(update) - update["dur_ms"] / 1000 if update else min(_ts(e) for e in entries)
+    end = max([total] + [(e.get("at_ms") or 0) + (e.get("dur_ms") or 0) for e in entries if "span" in e])
+    scale = BAR_WIDTH / end if end > 0 else 0
+
+    head = f"trace {trace_id}"
+    if update:
+        head += (f"  update_id={update.get('update_id')} {update.get('kind')} {update.get('data')!r}"
+                 f"  handler={update.get('op')}  total={update['dur_ms']:.1f} ms"
+                 f"  db={update.get('db_ms', 0):.1f} ms  api={update.get('api_ms', 0):.1f} ms"
+                 f"{'' if update.get('ok', True) else '  FAILED'}")
+    lines = [head]
+    rows = []
+    for e in entries:
+        if e is update:
+            continue
+        if "span" in e:
+            at = e.get("at_ms") or 0.0
+            rows.append((at, e["dur_ms"], f"{e['span']:<7} {e['op']}"
+                         + ("" if e.get("ok", True) else " FAILED")
+                         + (f" chat={e['chat_id']}" if e.get("chat_id") else "")))
+        else:
+            at = (_ts(e) - t0) * 1000
+            rows.append((at, 0.0, f"log     {e['level']}: {e['msg']}"))
+    for at, dur, label in sorted(rows, key=lambda r: r[0]):
+        start = int(at * scale)
+        bar = " " * min(start, BAR_WIDTH) + "█" * max(1, int(dur * scale)) if dur else " " * min(start, BAR_WIDTH) + "·"
+        after = "  (after the update)" if at > total else ""
+        lines.append(f"  {at:9.1f} ms {dur:9.1f} ms |{bar:<{BAR_WIDTH}.{BAR_WIDTH}}| {label}{after}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="JSON log file, '-' for stdin")
+    parser.add_argument("--trace", help="show this trace id only")
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest updates to show")
+    parser.add_argument("--min-ms", type=float, default=0.0, help="ignore updates faster than this")
+    args = parser.parse_args()
+
+    stream = sys.stdin if args.log == "-" else open(args.log, encoding="utf-8")
+    with stream:
+        traces = group_traces(read_entries(stream))
+
+    if args.trace:
+        if args.trace not in traces:
+            sys.exit(f"trace {args.trace} not found")
+        print(timeline(args.trace, traces[args.trace]))
+        return
+
+    ranked = []
+    for trace_id, entries in traces.items():
+        update = _update_span(entries)
+        if update and update["dur_ms"] >= args.min_ms:
+            ranked.append((update["dur_ms"], trace_id))
+    ranked.sort(reverse=True)
+    print(f"{len(traces)} traces, {len(ranked)} updates >= {args.min_ms:g} ms, showing {min(args.top, len(ranked))}\n")
+    for _, trace_id in ranked[:args.top]:
+        print(timeline(trace_id, traces[trace_id]))
+        print()
+
+if __name__ == "__main__":
+    main()